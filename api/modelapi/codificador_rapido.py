@@ -0,0 +1,127 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.compose import ColumnTransformer
+from sklearn.model_selection import GridSearchCV
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder
+
+
+# Codificador que reemplaza al ColumnTransformer/OneHotEncoder del pipeline en la ruta de predicción de la API.
+# Las categorías aprendidas se compilan en diccionarios valor -> columna, y la matriz de variables se arma
+# directamente con NumPy (sin DataFrame de pandas) para pasarla al regresor XGBoost del pipeline.
+class CodificadorRapido:
+    def __init__(self, modelo):
+        preprocesador = modelo.named_steps["preprocessor"]
+        regresor = modelo.named_steps["regressor"]
+
+        if not isinstance(preprocesador, ColumnTransformer):
+            raise ValueError("El preprocesador del modelo no es un ColumnTransformer")
+
+        # Si el regresor es una búsqueda de hiperparámetros se usa el mejor estimador, igual que GridSearchCV.predict
+        self.regresor = regresor.best_estimator_ if isinstance(regresor, GridSearchCV) else regresor
+        self.salida_dispersa = preprocesador.sparse_output_
+        self.n_columnas = 0
+
+        # Lista de (nombre de la columna de entrada, diccionario categoría -> columna de salida o None si es numérica)
+        self.columnas = []
+        nombres_entrada = list(preprocesador.feature_names_in_)
+
+        for _, transformador, columnas in preprocesador.transformers_:
+            if transformador == "drop":
+                continue
+
+            # Las columnas del remainder vienen como posiciones en lugar de nombres
+            columnas = [nombres_entrada[c] if isinstance(c, (int, np.integer)) else c for c in columnas]
+
+            if isinstance(transformador, OneHotEncoder):
+                if transformador.drop is not None or transformador.handle_unknown != "ignore":
+                    raise ValueError("Solo se soporta OneHotEncoder con handle_unknown='ignore' y sin drop")
+                for columna, categorias in zip(columnas, transformador.categories_):
+                    indice = {categoria: self.n_columnas + i for i, categoria in enumerate(categorias.tolist())}
+                    self.columnas.append((columna, indice))
+                    self.n_columnas += len(categorias)
+            elif transformador == "passthrough" or (isinstance(transformador, FunctionTransformer) and transformador.func is None):
+                for columna in columnas:
+                    self.columnas.append((columna, None))
+                    self.n_columnas += 1
+            else:
+                raise ValueError(f"Transformador no soportado por el codificador rápido: {transformador}")
+
+    # Construye la matriz de variables a partir de un diccionario columna -> lista de valores
+    def transformar(self, datos):
+        n_filas = len(next(iter(datos.values())))
+        indices = np.empty((n_filas, len(self.columnas)), dtype=np.int64)
+        valores = np.ones((n_filas, len(self.columnas)), dtype=np.float64)
+
+        inicio = 0
+        for j, (columna, indice) in enumerate(self.columnas):
+            if indice is None:
+                # Columna numérica: se copia el valor en su posición de salida
+                indices[:, j] = inicio
+                valores[:, j] = np.asarray(datos[columna], dtype=np.float64)
+                inicio += 1
+            else:
+                # Columna categórica: las categorías desconocidas se ignoran (-1), igual que handle_unknown='ignore'
+                indices[:, j] = [indice.get(valor, -1) for valor in datos[columna]]
+                inicio += len(indice)
+
+        # Las entradas vacías son las categorías desconocidas y los ceros numéricos, que la matriz dispersa no guarda
+        presentes = (indices >= 0) & (valores != 0)
+
+        if not self.salida_dispersa:
+            matriz = np.zeros((n_filas, self.n_columnas), dtype=np.float64)
+            filas = np.repeat(np.arange(n_filas), presentes.sum(axis=1))
+            matriz[filas, indices[presentes]] = valores[presentes]
+            return matriz
+
+        # Las columnas de cada fila ya quedan ordenadas porque los bloques de salida van en orden creciente
+        indptr = np.concatenate(([0], np.cumsum(presentes.sum(axis=1))))
+        return sp.csr_matrix((valores[presentes], indices[presentes], indptr), shape=(n_filas, self.n_columnas))
+
+    def predecir(self, datos):
+        return self.regresor.predict(self.transformar(datos))
+
+
+# Función para verificar que el codificador rápido produce exactamente las mismas predicciones que el pipeline
+def verificar_paridad(codificador, modelo, datos):
+    import pandas as pd
+
+    esperado = modelo.predict(pd.DataFrame(datos))
+    obtenido = codificador.predecir(datos)
+    return np.array_equal(esperado, obtenido), esperado, obtenido
+
+
+# Función para armar los datos de entrada de la API a partir de las combinaciones de min_fechas_predicciones.csv,
+# con los códigos de producto del tipo indicado (texto, como llegan a la API, o enteros)
+def datos_min_fechas(min_fechas_df, tipo_codigo=str):
+    return {
+        "Año": min_fechas_df["min_Anio"].tolist(),
+        "Mes": min_fechas_df["min_Mes"].tolist(),
+        "Uen": min_fechas_df["Uen"].tolist(),
+        "Regional": min_fechas_df["Regional"].tolist(),
+        "Canal Comercial": min_fechas_df["Canal Comercial"].tolist(),
+        "Marquilla": min_fechas_df["Marquilla"].tolist(),
+        "Código Producto": [tipo_codigo(codigo) for codigo in min_fechas_df["Código Producto"].tolist()],
+        "Producto": min_fechas_df["Producto"].tolist()
+    }
+
+
+# Verificación de paridad sobre todas las combinaciones de min_fechas_predicciones.csv
+# Se ejecuta desde la carpeta api/modelapi: python codificador_rapido.py
+if __name__ == "__main__":
+    import sys
+    import joblib
+    import pandas as pd
+
+    modelo = joblib.load("mejor_modelo.pkl")
+    codificador = CodificadorRapido(modelo)
+    min_fechas_df = pd.read_csv("min_fechas_predicciones.csv")
+
+    # Se prueban los códigos de producto como texto (como llegan a la API) y como enteros
+    for tipo_codigo in (str, int):
+        datos = datos_min_fechas(min_fechas_df, tipo_codigo)
+        iguales, esperado, obtenido = verificar_paridad(codificador, modelo, datos)
+        print(f"Código Producto como {tipo_codigo.__name__}: {len(esperado)} filas, paridad {'OK' if iguales else 'FALLIDA'}")
+        if not iguales:
+            diferentes = np.flatnonzero(esperado != obtenido)
+            print(f"Filas con diferencias: {diferentes[:10]}")
+            sys.exit(1)
@@ -0,0 +1,93 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Métricas en memoria del proceso, expuestas en el formato de texto de Prometheus en el endpoint /metrics.
+# Con varios workers de gunicorn cada proceso tiene sus propias métricas.
+
+# Límites superiores (en segundos) de los buckets de los histogramas de latencia
+BUCKETS_LATENCIA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Función para dar formato a las etiquetas de una serie, por ejemplo {etapa="prediccion_modelo"}
+def formatear_etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    pares = [f'{nombre}="{str(valor)}"' for nombre, valor in zip(nombres, valores)]
+    return "{" + ",".join(pares) + "}"
+
+
+# Contador acumulado, con una serie por combinación de etiquetas
+class Contador:
+    def __init__(self, nombre, descripcion, etiquetas=()):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.etiquetas = etiquetas
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def incrementar(self, *valores, cantidad=1):
+        with self.lock:
+            self.series[valores] = self.series.get(valores, 0) + cantidad
+
+    def renderizar(self):
+        lineas = [f"# HELP {self.nombre} {self.descripcion}", f"# TYPE {self.nombre} counter"]
+        with self.lock:
+            for valores, total in self.series.items():
+                lineas.append(f"{self.nombre}{formatear_etiquetas(self.etiquetas, valores)} {total}")
+        return lineas
+
+
+# Histograma de latencias, con una serie por combinación de etiquetas
+class Histograma:
+    def __init__(self, nombre, descripcion, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observar(self, segundos, *valores):
+        # Se guarda la cuenta de cada bucket por separado y se acumula al renderizar
+        posicion = bisect.bisect_left(self.buckets, segundos)
+        with self.lock:
+            serie = self.series.get(valores)
+            if serie is None:
+                serie = self.series[valores] = {"cuentas": [0] * (len(self.buckets) + 1), "suma": 0.0}
+            serie["cuentas"][posicion] += 1
+            serie["suma"] += segundos
+
+    @contextmanager
+    def medir(self, *valores):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, *valores)
+
+    def renderizar(self):
+        lineas = [f"# HELP {self.nombre} {self.descripcion}", f"# TYPE {self.nombre} histogram"]
+        with self.lock:
+            for valores, serie in self.series.items():
+                acumulado = 0
+                for limite, cuenta in zip(self.buckets, serie["cuentas"]):
+                    acumulado += cuenta
+                    etiquetas = formatear_etiquetas(self.etiquetas + ("le",), valores + (limite,))
+                    lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+                acumulado += serie["cuentas"][-1]
+                etiquetas = formatear_etiquetas(self.etiquetas + ("le",), valores + ("+Inf",))
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+                lineas.append(f"{self.nombre}_sum{formatear_etiquetas(self.etiquetas, valores)} {serie['suma']}")
+                lineas.append(f"{self.nombre}_count{formatear_etiquetas(self.etiquetas, valores)} {acumulado}")
+        return lineas
+
+
+# Función para renderizar valores calculados fuera de este módulo (por defecto gauge) con varias series
+def renderizar_valores(nombre, descripcion, series, etiquetas=(), tipo="gauge"):
+    lineas = [f"# HELP {nombre} {descripcion}", f"# TYPE {nombre} {tipo}"]
+    for valores, valor in series:
+        lineas.append(f"{nombre}{formatear_etiquetas(etiquetas, valores)} {valor}")
+    return lineas
@@ -2,35 +2,194 @@ import uvicorn
 import joblib
 import yaml
 import pandas as pd
+import numpy as np
 import os
+import gc
+import json
+import time
+import asyncio
+import hashlib
+import random
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from fastapi import FastAPI
+from typing import List
+from fastapi import FastAPI, Request
 from pydantic import BaseModel
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from loguru import logger
 import sys
+from metricas import Contador, Histograma, renderizar_valores
 
-# Crear la carpeta logs si no existe
-log_dir = "logs"
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-# Configurar el logger con loguru
-logger.add(f"{log_dir}/app.log", rotation="1 week", level="INFO", format="{time} - {level} - {message}", encoding="utf-8")
-logger.add(sys.stdout, level="INFO", format="{time} - {level} - {message}")
+# Rutas de los artefactos de la API
+ruta_modelo = "mejor_modelo.pkl"
+ruta_config = "config.yml"
 
-# Cargar el modelo guardado con joblib
-modelo = joblib.load("mejor_modelo.pkl")
+# El modelo guardado con joblib se carga en cargar_artefactos(), al iniciar la API
+modelo = None
 
 # Función para leer el archivo YAML de configuración
 def leer_config():
-    with open("config.yml", "r") as file:
+    with open(ruta_config, "r") as file:
         config = yaml.safe_load(file)  # Cargar el contenido del archivo YAML
     return config
 
 # Leer el año y mes mínimo desde el archivo de configuración
 config = leer_config()
 
+# Crear la carpeta logs si no existe
+log_dir = "logs"
+if not os.path.exists(log_dir):
+    os.makedirs(log_dir)
+
+# Configurar el logger con loguru
+# Con logs asíncronos los mensajes se encolan (enqueue) y un hilo aparte los escribe, sin bloquear las solicitudes;
+# el archivo se escribe por bloques de buffer_bytes en lugar de línea por línea.
+# Se quita el handler por defecto de loguru (stderr síncrono): la consola se escribe con el handler de stdout
+config_logs = config.get("logs", {})
+logs_asincronos = config_logs.get("asincrono", False)
+logger.remove()
+logger.add(
+    f"{log_dir}/app.log", rotation="1 week", level="INFO", format="{time} - {level} - {message}", encoding="utf-8",
+    enqueue=logs_asincronos, buffering=config_logs.get("buffer_bytes", 1), serialize=config_logs.get("json", False)
+)
+logger.add(
+    sys.stdout, level="INFO", format="{time} - {level} - {message}",
+    enqueue=logs_asincronos, serialize=config_logs.get("json", False)
+)
+
+
+# Función para decidir si en una solicitud se registran las líneas de detalle por mes (muestreo)
+def registrar_detalle():
+    return random.random() < config.get("logs", {}).get("muestreo_detalle", 1.0)
+
+
+# Función para identificar la versión de un artefacto a partir de su fecha de modificación y tamaño
+def version_archivo(ruta):
+    estado = os.stat(ruta)
+    return (estado.st_mtime_ns, estado.st_size)
+
+
+# Versión actual del modelo y de la configuración, usada para invalidar la caché de predicciones
+version_modelo = (version_archivo(ruta_modelo), version_archivo(ruta_config))
+
+
+# Caché en memoria de predicciones con tamaño máximo, expulsión LRU y TTL opcional
+class CachePredicciones:
+    def __init__(self, max_entradas=1024, ttl_segundos=None):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.entradas = OrderedDict()
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave):
+        with self.lock:
+            entrada = self.entradas.get(clave)
+            if entrada is not None:
+                valor, creado = entrada
+                if self.ttl_segundos and time.monotonic() - creado > self.ttl_segundos:
+                    # La entrada expiró, se descarta y se cuenta como fallo
+                    del self.entradas[clave]
+                else:
+                    self.entradas.move_to_end(clave)
+                    self.aciertos += 1
+                    return valor
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave, valor):
+        with self.lock:
+            self.entradas[clave] = (valor, time.monotonic())
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.max_entradas:
+                self.entradas.popitem(last=False)
+                self.expulsiones += 1
+
+    def limpiar(self):
+        with self.lock:
+            self.entradas.clear()
+
+    def estadisticas(self):
+        with self.lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self.entradas),
+                "max_entradas": self.max_entradas,
+                "ttl_segundos": self.ttl_segundos,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0
+            }
+
+
+# Crear la caché de predicciones con los parámetros del archivo de configuración
+config_cache = config.get("cache", {})
+cache_predicciones = CachePredicciones(
+    max_entradas=config_cache.get("max_entradas", 1024),
+    ttl_segundos=config_cache.get("ttl_segundos")
+)
+
+
+# Lock para que un solo hilo recargue los artefactos cuando cambian en disco
+lock_recarga = threading.Lock()
+
+
+# Función para recargar el modelo y la configuración si cambiaron en disco, invalidando la caché
+def verificar_artefactos():
+    global modelo, config, version_modelo
+    if (version_archivo(ruta_modelo), version_archivo(ruta_config)) == version_modelo:
+        return
+    with lock_recarga:
+        version = (version_archivo(ruta_modelo), version_archivo(ruta_config))
+        if version == version_modelo:
+            return
+        logger.info("El modelo o la configuración cambiaron, recargando artefactos e invalidando la caché")
+        modelo = joblib.load(ruta_modelo)
+        config = leer_config()
+        cache_predicciones.limpiar()
+        cache_predicciones.max_entradas = config.get("cache", {}).get("max_entradas", 1024)
+        cache_predicciones.ttl_segundos = config.get("cache", {}).get("ttl_segundos")
+        recargar_predicciones_precalculadas()
+        recargar_codificador_rapido()
+        # La versión se actualiza al final, para que ninguna solicitud guarde en la caché con la versión nueva
+        # una predicción hecha con artefactos anteriores
+        version_modelo = version
+
+
+# Función para saber si el modelo, la configuración o el CSV de fechas mínimas cambiaron en disco (solo os.stat,
+# no bloquea el event loop)
+def artefactos_modificados():
+    return ((version_archivo(ruta_modelo), version_archivo(ruta_config)) != version_modelo
+            or os.path.getmtime(ruta_min_fechas) != mtime_min_fechas)
+
+
+# Función para recargar los artefactos que cambiaron en disco
+def recargar_artefactos_modificados():
+    verificar_artefactos()
+    verificar_indice_fechas()
+
+
+# Futuro de la recarga en curso, compartido por las solicitudes que llegan mientras se recargan los artefactos
+futuro_recarga = None
+
+
+# Función para recargar en el pool de hilos de predicción los artefactos que cambiaron en disco, sin bloquear el
+# event loop con joblib.load ni con la lectura del CSV. Las solicitudes esperan a que termine la recarga.
+async def esperar_recarga():
+    global futuro_recarga
+    if futuro_recarga is None or futuro_recarga.done():
+        if not artefactos_modificados():
+            return
+        futuro_recarga = asyncio.get_running_loop().run_in_executor(executor_prediccion, recargar_artefactos_modificados)
+    # shield: si una solicitud se cancela no se cancela la recarga que esperan las demás
+    await asyncio.shield(futuro_recarga)
+
 # Definir la estructura de los datos de entrada con Pydantic
 class InputData(BaseModel):
     meses_a_proyectar: int  # El número de meses a proyectar
@@ -41,52 +200,159 @@ class InputData(BaseModel):
     Codigo_Producto: str
     Producto: str
 
+# Estructura de una combinación de variables para las predicciones en lote
+class CombinacionData(BaseModel):
+    Uen: str
+    Regional: str
+    Canal_Comercial: str
+    Marquilla: str
+    Codigo_Producto: str
+    Producto: str
+
+# Estructura de los datos de entrada para las predicciones en lote
+class BatchInputData(BaseModel):
+    meses_a_proyectar: int  # El número de meses a proyectar para todas las combinaciones
+    combinaciones: List[CombinacionData]
+
+# Con carga diferida la API empieza a recibir conexiones de inmediato y los artefactos se cargan en segundo plano
+carga_diferida = config.get("servidor", {}).get("carga_diferida", False)
+
+
+# Al iniciar el servidor se lanza la carga de artefactos en segundo plano si la carga es diferida
+@asynccontextmanager
+async def ciclo_de_vida(app):
+    if carga_diferida:
+        iniciar_carga_diferida()
+    yield
+    # Al detener el servidor se espera a que se escriban los logs pendientes en la cola
+    await logger.complete()
+
+
 # Inicializar la aplicación FastAPI
 app = FastAPI(
     title="API de predicción de Ventas Empresa XYZ DSA Grupo 5",  # Título personalizado
     description="API para realizar predicciones de Ventas a partir de la selección de variables del usuario de la Empresa XYZ",  # Descripción personalizada
-    version=config.get("version", "x.x.x")  # Versión personalizada
+    version=config.get("version", "x.x.x"),  # Versión personalizada
+    lifespan=ciclo_de_vida
 )
 
 
 
-#Cargar el CSV con las mínimas fechas para las predicciones por cada combinación de variables predictoras, este archivo solo cambia, si la base de entrenamiento cambia
-min_fechas_df = pd.read_csv('./min_fechas_predicciones.csv')
+#Ruta del CSV con las mínimas fechas para las predicciones por cada combinación de variables predictoras, este archivo solo cambia, si la base de entrenamiento cambia
+ruta_min_fechas = './min_fechas_predicciones.csv'
+
+
+# Métricas de la API expuestas en /metrics
+solicitudes_total = Contador("modelapi_solicitudes_total", "Número de solicitudes por ruta y código de estado", ("ruta", "estado"))
+latencia_solicitudes = Histograma("modelapi_latencia_solicitud_segundos", "Latencia de las solicitudes por ruta", ("ruta",))
+latencia_etapas = Histograma("modelapi_latencia_etapa_segundos", "Latencia de cada etapa de la predicción", ("etapa",))
+origen_predicciones = Contador("modelapi_predicciones_total", "Predicciones de /predict/ según su origen (cache, precalculada, modelo)", ("origen",))
+
+
+# Función para recorrer el cuerpo de una respuesta y registrar la latencia cuando se termina de enviar. call_next
+# regresa al enviar los encabezados, y en las respuestas en streaming (/predict/batch) el cuerpo se genera después
+async def cuerpo_medido(cuerpo, inicio, ruta):
+    try:
+        async for parte in cuerpo:
+            yield parte
+    finally:
+        latencia_solicitudes.observar(time.perf_counter() - inicio, ruta)
+
+
+# Función para obtener la ruta de una solicitud tal como se declaró en la API (por ejemplo /predict/)
+def ruta_solicitud(request):
+    ruta = request.scope.get("route")
+    return ruta.path if ruta is not None else "desconocida"
+
+
+# Middleware para contar las solicitudes y medir su latencia por ruta, hasta el final del cuerpo de la respuesta.
+# Si un endpoint lanza una excepción no hay respuesta: se registra como error 500 y la excepción sigue su curso
+@app.middleware("http")
+async def medir_solicitudes(request: Request, call_next):
+    inicio = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        ruta = ruta_solicitud(request)
+        solicitudes_total.incrementar(ruta, 500)
+        latencia_solicitudes.observar(time.perf_counter() - inicio, ruta)
+        raise
+    ruta = ruta_solicitud(request)
+    solicitudes_total.incrementar(ruta, response.status_code)
+    response.body_iterator = cuerpo_medido(response.body_iterator, inicio, ruta)
+    return response
+
+
+# Función para construir el índice (Uen, Regional, Canal Comercial, Marquilla, Código Producto, Producto) -> (min_Anio, min_Mes, fila del CSV)
+def cargar_indice_fechas():
+    min_fechas_df = pd.read_csv(ruta_min_fechas)
+    claves = zip(
+        min_fechas_df['Uen'].tolist(),
+        min_fechas_df['Regional'].tolist(),
+        min_fechas_df['Canal Comercial'].tolist(),
+        min_fechas_df['Marquilla'].tolist(),
+        min_fechas_df['Código Producto'].tolist(),
+        min_fechas_df['Producto'].tolist()
+    )
+
+    indice = {}
+    for fila, (clave, min_anio, min_mes) in enumerate(zip(claves, min_fechas_df['min_Anio'].tolist(), min_fechas_df['min_Mes'].tolist())):
+        # Si una combinación está repetida se conserva la primera fila, igual que el filtro original
+        indice.setdefault(clave, (min_anio, min_mes, fila))
+
+    logger.info(f"Índice de fechas mínimas cargado con {len(indice)} combinaciones")
+    return indice
+
+
+#El índice y la fecha de modificación del CSV (para recargarlo si cambia) se cargan en cargar_artefactos()
+indice_fechas = {}
+mtime_min_fechas = None
+
+
+# Función para recargar el índice cuando el CSV de fechas mínimas se actualiza en disco
+def verificar_indice_fechas():
+    global indice_fechas, mtime_min_fechas
+    if os.path.getmtime(ruta_min_fechas) == mtime_min_fechas:
+        return
+    with lock_recarga:
+        mtime = os.path.getmtime(ruta_min_fechas)
+        if mtime == mtime_min_fechas:
+            return
+        logger.info("El CSV de fechas mínimas cambió, recargando el índice")
+        indice_fechas = cargar_indice_fechas()
+        recargar_predicciones_precalculadas()
+        mtime_min_fechas = mtime
+
+
+# Función para obtener la clave de la combinación en el índice de fechas mínimas
+def clave_combinacion(data):
+    return (data.Uen, data.Regional, data.Canal_Comercial, data.Marquilla, int(data.Codigo_Producto), data.Producto)
 
 
 # Función para encontrar la fecha inicial para realizar las predicciones de acuerdo a la combinación de variables seleccionada por el usuario 
 def obtener_fecha_inicio(data: InputData):
-    data_filtrada = min_fechas_df[
-        (min_fechas_df['Uen'] == data.Uen) &
-        (min_fechas_df['Regional'] == data.Regional) &
-        (min_fechas_df['Canal Comercial'] == data.Canal_Comercial) &
-        (min_fechas_df['Marquilla'] == data.Marquilla) &
-        (min_fechas_df['Código Producto'] == int(data.Codigo_Producto)) &
-        (min_fechas_df['Producto'] == data.Producto) 
-    ]
+    verificar_indice_fechas()
+
+    with latencia_etapas.medir("fecha_inicio"):
+        fecha_minima = indice_fechas.get(clave_combinacion(data))
 
     # Verificar si hay resultados e insertar la validación en los logs
-    if data_filtrada.empty:
+    if fecha_minima is None:
         logger.error("No se encontraron datos para la combinación proporcionada")
         logger.error(str(data.Uen) +' '+ str(data.Regional) +' '+ str(data.Canal_Comercial) +' '+ str(data.Marquilla) +' '+ str(data.Codigo_Producto) +' '+ str(data.Producto) )
         raise ValueError("Combinación de variables no encontrada en el CSV")
     
-    min_anio = data_filtrada['min_Anio'].values[0]
-    min_mes = data_filtrada['min_Mes'].values[0]
+    min_anio, min_mes, _ = fecha_minima
     
     fecha_inicio = datetime(min_anio, min_mes, 1)
 
     return fecha_inicio
 
 
-# Función para calcular las combinaciones de Año y Mes
-def calcular_fechas_inicio(meses_a_proyectar: int , data):
+# Función para calcular las combinaciones de Año y Mes a partir de una fecha inicial
+def calcular_fechas(fecha_inicial, meses_a_proyectar: int):
     fechas = []
 
-    fecha_inicial = obtener_fecha_inicio(data)
-    logger.info(print(type(fecha_inicial)))
-    logger.info(print(fecha_inicial))
-    # Calcular las combinaciones de Año y Mes a partir de la fecha mínima de predicción
     for i in range(meses_a_proyectar):
         nueva_fecha = fecha_inicial + timedelta(days=30 * i)  # Aproximación de 30 días por mes
         fechas.append((nueva_fecha.year, nueva_fecha.month))
@@ -94,54 +360,406 @@ def calcular_fechas_inicio(meses_a_proyectar: int , data):
     return fechas
 
 
+# Función para calcular las combinaciones de Año y Mes
+def calcular_fechas_inicio(meses_a_proyectar: int , data):
+    fecha_inicial = obtener_fecha_inicio(data)
+    logger.debug(f"Fecha inicial de la predicción: {fecha_inicial}")
+    # Calcular las combinaciones de Año y Mes a partir de la fecha mínima de predicción
+    return calcular_fechas(fecha_inicial, meses_a_proyectar)
+
+
+# Función para calcular el hash de un archivo, usado para validar la tabla de predicciones precalculadas
+def hash_archivo(ruta):
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as file:
+        for bloque in iter(lambda: file.read(1 << 20), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+# Rutas de la tabla de predicciones precalculadas (generada con precalcular_predicciones.py) y de sus metadatos
+ruta_precalculadas = config.get("precalculadas", {}).get("ruta", "predicciones_precalculadas.npy")
+ruta_meta_precalculadas = os.path.splitext(ruta_precalculadas)[0] + ".json"
+
+
+# Función para abrir la tabla precalculada en modo memory-map, solo si corresponde al modelo y CSV actuales
+def cargar_predicciones_precalculadas():
+    if not (os.path.exists(ruta_precalculadas) and os.path.exists(ruta_meta_precalculadas)):
+        logger.info("No hay tabla de predicciones precalculadas, se usará el modelo en cada solicitud")
+        return None
+
+    with open(ruta_meta_precalculadas, "r") as file:
+        meta = json.load(file)
+
+    if meta.get("hash_modelo") != hash_archivo(ruta_modelo) or meta.get("hash_min_fechas") != hash_archivo(ruta_min_fechas):
+        logger.warning("La tabla de predicciones precalculadas no corresponde al modelo o al CSV actuales, se ignora")
+        return None
+
+    # Con mmap_mode los workers de uvicorn comparten las mismas páginas del archivo en memoria
+    tabla = np.load(ruta_precalculadas, mmap_mode="r")
+    logger.info(f"Tabla de predicciones precalculadas cargada: {tabla.shape[0]} combinaciones x {tabla.shape[1]} meses")
+    return tabla
+
+
+tabla_precalculada = None
+
+
+# Función para volver a abrir la tabla precalculada cuando cambia el modelo o el CSV de fechas mínimas
+def recargar_predicciones_precalculadas():
+    global tabla_precalculada
+    tabla_precalculada = cargar_predicciones_precalculadas()
+
+
+# Función para buscar las predicciones de una combinación en la tabla precalculada, devuelve None si no están
+def buscar_precalculadas(data, meses_a_proyectar: int):
+    tabla = tabla_precalculada
+    if tabla is None or meses_a_proyectar > tabla.shape[1]:
+        return None
+
+    fecha_minima = indice_fechas.get(clave_combinacion(data))
+    if fecha_minima is None:
+        return None
+
+    min_anio, min_mes, fila = fecha_minima
+    predicciones = tabla[fila, :meses_a_proyectar]
+    if np.isnan(predicciones).any():
+        return None
+
+    fechas = calcular_fechas(datetime(min_anio, min_mes, 1), meses_a_proyectar)
+    return [
+        {"Año": año, "Mes": mes, "Ventas": float(prediccion)}
+        for (año, mes), prediccion in zip(fechas, predicciones)
+    ]
+
+
 # Redirigir la ruta raíz (/) a /docs automáticamente
 @app.get("/")
 async def redirect_to_docs():
     return RedirectResponse(url="/docs")
 
 
-# Endpoint POST para realizar predicciones
-@app.post("/predict/")
-async def predict(data: InputData):
+# Función para construir las columnas (nombre -> lista de valores) de varias combinaciones, cada una con sus fechas a proyectar
+def construir_columnas_lote(items):
+    with latencia_etapas.medir("construccion_filas"):
+        filas = [(fecha, data) for fechas, data in items if not isinstance(fechas, Exception) for fecha in fechas]
+        return {
+            "Año": [fecha[0] for fecha, _ in filas],
+            "Mes": [fecha[1] for fecha, _ in filas],
+            "Uen": [data.Uen for _, data in filas],
+            "Regional": [data.Regional for _, data in filas],
+            "Canal Comercial": [data.Canal_Comercial for _, data in filas],
+            "Marquilla": [data.Marquilla for _, data in filas],
+            "Código Producto": [data.Codigo_Producto for _, data in filas],
+            "Producto": [data.Producto for _, data in filas]
+        }
+
+
+# Función para predecir todas las filas en una sola llamada al modelo
+def predecir_filas(input_df):
+    try:
+        return [float(prediccion) for prediccion in modelo.predict(input_df)], []
+    except Exception:
+        # Si la predicción en bloque falla, se predice fila por fila para reportar el error de cada mes
+        predicciones = []
+        errores = []
+        for i in range(len(input_df)):
+            try:
+                predicciones.append(float(modelo.predict(input_df.iloc[[i]])[0]))
+            except Exception as e:
+                predicciones.append(None)
+                errores.append((i, e))
+        return predicciones, errores
+
+
+# Función para crear el codificador rápido y verificar que sus predicciones sean idénticas a las del pipeline
+def crear_codificador_rapido():
+    if not config.get("prediccion", {}).get("codificador_rapido", False):
+        return None
+
+    try:
+        # Se importa aquí para no cargar sklearn antes de que el servidor empiece a recibir conexiones
+        from codificador_rapido import CodificadorRapido, datos_min_fechas, verificar_paridad
+
+        codificador_nuevo = CodificadorRapido(modelo)
+        muestra = pd.read_csv(ruta_min_fechas, nrows=500)
+        iguales, _, _ = verificar_paridad(codificador_nuevo, modelo, datos_min_fechas(muestra))
+    except Exception as e:
+        logger.warning(f"No fue posible crear el codificador rápido, se usará el pipeline de sklearn | Error: {str(e)}")
+        return None
+
+    if not iguales:
+        logger.warning("Las predicciones del codificador rápido no coinciden con el pipeline, se usará el pipeline de sklearn")
+        return None
+
+    logger.info("Codificador rápido activo para las predicciones")
+    return codificador_nuevo
+
+
+codificador = None
+
+
+# Función para volver a crear el codificador rápido cuando cambia el modelo
+def recargar_codificador_rapido():
+    global codificador
+    codificador = crear_codificador_rapido()
+
+
+# Función para predecir las filas con el codificador rápido, o con el pipeline de sklearn si no está activo o falla
+def predecir_columnas(columnas):
+    with latencia_etapas.medir("prediccion_modelo"):
+        codificador_actual = codificador
+        if codificador_actual is not None:
+            try:
+                return [float(prediccion) for prediccion in codificador_actual.predecir(columnas)], []
+            except Exception as e:
+                logger.warning(f"Error en el codificador rápido, se usa el pipeline de sklearn | Error: {str(e)}")
+
+        return predecir_filas(pd.DataFrame(columnas))
+
+
+# Función para serializar la respuesta de /predict/ midiendo el tiempo de serialización
+def responder(resultados):
+    with latencia_etapas.medir("serializacion"):
+        return JSONResponse(content={"result": resultados})
+
+
+# Pool de hilos para ejecutar la predicción con el modelo fuera del event loop, configurable en config.yml
+executor_prediccion = ThreadPoolExecutor(
+    max_workers=config.get("servidor", {}).get("hilos_prediccion", 4),
+    thread_name_prefix="prediccion"
+)
+
+
+# Función que realiza la predicción con el modelo para una combinación (trabajo de CPU, se ejecuta en el pool de hilos)
+def predecir_combinacion(data: InputData, detalle: bool = True):
     # Calcular las combinaciones de Año y Mes para los meses a proyectar
     fechas = calcular_fechas_inicio(data.meses_a_proyectar,data)
 
     resultados = []
 
-    # Realizar la predicción para cada combinación de Año y Mes
-    for año, mes in fechas:
-        # Crear un DataFrame para pasar al modelo
-        input_df = pd.DataFrame([{
+    if not fechas:
+        return resultados, []
+
+    # Construir todas las filas del horizonte y realizar la predicción en bloque
+    columnas = construir_columnas_lote([(fechas, data)])
+    predicciones, errores = predecir_columnas(columnas)
+
+    for i, error in errores:
+        # Log del error si ocurre alguna excepción durante la predicción
+        año, mes = fechas[i]
+        logger.error(f"Error durante la predicción para Año: {año}, Mes: {mes} | Error: {str(error)}")
+
+    for (año, mes), prediccion_float in zip(fechas, predicciones):
+        if prediccion_float is None:
+            continue
+
+        resultados.append({
             "Año": año,
             "Mes": mes,
-            "Uen": data.Uen,
-            "Regional": data.Regional,
-            "Canal Comercial": data.Canal_Comercial,
-            "Marquilla": data.Marquilla,
-            "Código Producto": data.Codigo_Producto,
-            "Producto": data.Producto
-        }])
-
-        # Realizar la predicción
-        try:
-            prediccion = modelo.predict(input_df)
-            prediccion_float = float(prediccion[0])
-
-            resultados.append({
-                "Año": año,
-                "Mes": mes,
-                "Ventas": prediccion_float
-            })
-            # Log del intento y resultado de la predicción
+            "Ventas": prediccion_float
+        })
+        # Log del intento y resultado de la predicción, solo en las solicitudes muestreadas
+        if detalle:
             logger.info(f"Predicción realizada para Año: {año}, Mes: {mes} | Resultado: {prediccion_float}")
-        except Exception as e:
-            # Log del error si ocurre alguna excepción durante la predicción
-            logger.error(f"Error durante la predicción para Año: {año}, Mes: {mes} | Error: {str(e)}")
+
+    return resultados, errores
+
+
+# Endpoint POST para realizar predicciones
+@app.post("/predict/")
+async def predict(data: InputData):
+    await esperar_artefactos()
+    detalle = registrar_detalle()
+
+    # Buscar la predicción en la caché con la versión vigente del modelo y de las fechas mínimas
+    await esperar_recarga()
+    clave_cache = (
+        data.Uen, data.Regional, data.Canal_Comercial, data.Marquilla, data.Codigo_Producto, data.Producto,
+        data.meses_a_proyectar, version_modelo, mtime_min_fechas
+    )
+    resultados_cache = cache_predicciones.obtener(clave_cache)
+    if resultados_cache is not None:
+        logger.info(f"Predicción obtenida de la caché: {resultados_cache if detalle else len(resultados_cache)}")
+        origen_predicciones.incrementar("cache")
+        return responder(resultados_cache)
+
+    # Responder desde la tabla precalculada y solo usar el modelo si la combinación u horizonte no están
+    resultados_precalculados = buscar_precalculadas(data, data.meses_a_proyectar)
+    if resultados_precalculados is not None:
+        logger.info(f"Predicción obtenida de la tabla precalculada: {resultados_precalculados if detalle else len(resultados_precalculados)}")
+        origen_predicciones.incrementar("precalculada")
+        return responder(resultados_precalculados)
+
+    # Ejecutar la predicción en el pool de hilos para no bloquear las demás solicitudes
+    loop = asyncio.get_running_loop()
+    resultados, errores = await loop.run_in_executor(executor_prediccion, predecir_combinacion, data, detalle)
 
     # Log del final de la solicitud con los resultados completos
-    logger.info(f"Resultado de la predicción: {resultados}")
-    
-    return {"result": resultados}
+    # Si la solicitud no fue muestreada solo se registra el número de meses predichos
+    logger.info(f"Resultado de la predicción: {resultados if detalle else len(resultados)}")
+
+    # Solo se guardan en caché las predicciones completas, sin errores
+    if not errores:
+        cache_predicciones.guardar(clave_cache, resultados)
+
+    origen_predicciones.incrementar("modelo")
+    return responder(resultados)
+
+
+# Función para predecir un lote de combinaciones y generar una línea NDJSON por combinación
+def predecir_lote(items):
+    columnas = construir_columnas_lote(items)
+    predicciones, errores = predecir_columnas(columnas) if columnas["Año"] else ([], [])
+
+    for i, error in errores:
+        logger.error(f"Error durante la predicción en lote para la fila {i} | Error: {str(error)}")
+
+    inicio = 0
+    for fechas, data in items:
+        if isinstance(fechas, Exception):
+            # Las combinaciones que no existen se reportan en su propia línea sin detener el lote
+            yield json.dumps({**data.model_dump(), "error": str(fechas)}, ensure_ascii=False) + "\n"
+            continue
+
+        resultados = []
+        for (año, mes), prediccion_float in zip(fechas, predicciones[inicio:inicio + len(fechas)]):
+            if prediccion_float is not None:
+                resultados.append({"Año": año, "Mes": mes, "Ventas": prediccion_float})
+        inicio += len(fechas)
+        yield json.dumps({**data.model_dump(), "result": resultados}, ensure_ascii=False) + "\n"
+
+
+# Generador que recorre las combinaciones por bloques para mantener acotada la memoria
+def generar_predicciones_lote(data: BatchInputData):
+    tamano_lote = config.get("batch", {}).get("tamano_lote", 5000)
+    items = []
+    filas = 0
+
+    for combinacion in data.combinaciones:
+        try:
+            fechas = calcular_fechas_inicio(data.meses_a_proyectar, combinacion)
+            filas += len(fechas)
+        except ValueError as e:
+            fechas = e
+
+        items.append((fechas, combinacion))
+        if filas >= tamano_lote:
+            yield from predecir_lote(items)
+            items = []
+            filas = 0
+
+    if items:
+        yield from predecir_lote(items)
+
+    logger.info(f"Predicción en lote finalizada para {len(data.combinaciones)} combinaciones")
+
+
+# Endpoint GET con los contadores de aciertos y fallos de la caché de predicciones
+@app.get("/cache/stats")
+async def cache_stats():
+    return cache_predicciones.estadisticas()
+
+
+# Endpoint GET con las métricas de la API en formato de texto de Prometheus
+@app.get("/metrics")
+async def metrics():
+    estadisticas_cache = cache_predicciones.estadisticas()
+    lineas = (
+        solicitudes_total.renderizar()
+        + latencia_solicitudes.renderizar()
+        + latencia_etapas.renderizar()
+        + origen_predicciones.renderizar()
+        + renderizar_valores("modelapi_cache_aciertos_total", "Aciertos acumulados de la caché de predicciones", [((), estadisticas_cache["aciertos"])], tipo="counter")
+        + renderizar_valores("modelapi_cache_fallos_total", "Fallos acumulados de la caché de predicciones", [((), estadisticas_cache["fallos"])], tipo="counter")
+        + renderizar_valores("modelapi_cache_tasa_aciertos", "Proporción de aciertos de la caché de predicciones", [((), estadisticas_cache["tasa_aciertos"])])
+        + renderizar_valores("modelapi_cache_entradas", "Entradas actuales en la caché de predicciones", [((), estadisticas_cache["entradas"])])
+        + renderizar_valores("modelapi_tiempo_carga_segundos", "Tiempo de carga de los artefactos por fase", [((fase,), segundos) for fase, segundos in tiempos_carga.items()], ("fase",))
+    )
+    return PlainTextResponse("\n".join(lineas) + "\n", media_type="text/plain; version=0.0.4")
+
+
+# Endpoint POST para realizar predicciones de varias combinaciones, con respuesta en streaming NDJSON
+@app.post("/predict/batch")
+async def predict_batch(data: BatchInputData):
+    await esperar_artefactos()
+    await esperar_recarga()
+    return StreamingResponse(generar_predicciones_lote(data), media_type="application/x-ndjson")
+
+# Tiempos de carga de cada fase del arranque, en segundos
+tiempos_carga = {}
+
+# Futuro de la carga en segundo plano cuando la carga es diferida
+futuro_carga = None
+
+
+# Función para ejecutar una fase de la carga y registrar su duración
+def medir_fase(nombre, funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    tiempos_carga[nombre] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+
+# Función para cargar los artefactos de la API; las fases independientes se ejecutan en paralelo
+def cargar_artefactos():
+    global modelo, indice_fechas, mtime_min_fechas, tabla_precalculada, codificador
+    inicio = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="carga") as pool:
+        # Fase 1: el modelo y el índice de fechas mínimas no dependen entre sí
+        mtime = os.path.getmtime(ruta_min_fechas)
+        futuro_modelo = pool.submit(medir_fase, "modelo", joblib.load, ruta_modelo)
+        futuro_indice = pool.submit(medir_fase, "indice_fechas", cargar_indice_fechas)
+        modelo = futuro_modelo.result()
+        indice_fechas = futuro_indice.result()
+        mtime_min_fechas = mtime
+
+        # Fase 2: la tabla precalculada y el codificador rápido necesitan el modelo y el CSV
+        futuro_tabla = pool.submit(medir_fase, "predicciones_precalculadas", cargar_predicciones_precalculadas)
+        futuro_codificador = pool.submit(medir_fase, "codificador_rapido", crear_codificador_rapido)
+        tabla_precalculada = futuro_tabla.result()
+        codificador = futuro_codificador.result()
+
+    tiempos_carga["total"] = round(time.perf_counter() - inicio, 3)
+    logger.info(f"Artefactos cargados en {tiempos_carga['total']} s | Tiempos por fase: {tiempos_carga}")
+
+
+# Función para lanzar la carga de artefactos en un hilo sin bloquear el arranque del servidor
+def iniciar_carga_diferida():
+    global futuro_carga
+    futuro_carga = ThreadPoolExecutor(max_workers=1, thread_name_prefix="carga-diferida").submit(cargar_artefactos)
+
+
+# Función para esperar a que terminen de cargarse los artefactos antes de atender una predicción
+async def esperar_artefactos():
+    if futuro_carga is not None and not futuro_carga.done():
+        await asyncio.wrap_future(futuro_carga)
+    elif futuro_carga is not None:
+        futuro_carga.result()  # Propaga el error si la carga falló
+
+
+# Endpoint GET de liveness: el proceso está vivo y atendiendo solicitudes
+@app.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+
+# Endpoint GET de readiness: los artefactos están cargados y la API puede predecir
+@app.get("/health/ready")
+async def health_ready():
+    if futuro_carga is not None and not futuro_carga.done():
+        return JSONResponse(status_code=503, content={"status": "cargando", "tiempos_carga": tiempos_carga})
+    if futuro_carga is not None and futuro_carga.exception() is not None:
+        return JSONResponse(status_code=503, content={"status": "error", "error": str(futuro_carga.exception())})
+    return {"status": "ready", "tiempos_carga": tiempos_carga}
+
+
+if not carga_diferida:
+    cargar_artefactos()
+
+    # Congelar los objetos ya cargados (modelo, índice y tablas) para que el recolector de basura no escriba
+    # sobre sus páginas y los workers de gunicorn (--preload) las sigan compartiendo copy-on-write después del fork
+    gc.freeze()
 
 # Ejecutar el servidor FastAPI con Uvicorn
 if __name__ == "__main__":
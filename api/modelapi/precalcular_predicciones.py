@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import modelapi
+
+
+# Script para precalcular las predicciones de todas las combinaciones de min_fechas_predicciones.csv
+# con el modelo actual, y guardarlas en una tabla .npy que la API abre en modo memory-map.
+# Se ejecuta desde la carpeta api/modelapi: python precalcular_predicciones.py --horizonte 24
+
+
+# Función para predecir todas las combinaciones del CSV por bloques y llenar la tabla de predicciones
+def precalcular(horizonte: int, tamano_lote: int):
+    min_fechas_df = pd.read_csv(modelapi.ruta_min_fechas)
+    tabla = np.full((len(min_fechas_df), horizonte), np.nan, dtype=np.float32)
+
+    combinaciones = [
+        modelapi.CombinacionData(
+            Uen=fila['Uen'],
+            Regional=fila['Regional'],
+            Canal_Comercial=fila['Canal Comercial'],
+            Marquilla=fila['Marquilla'],
+            Codigo_Producto=str(fila['Código Producto']),
+            Producto=fila['Producto']
+        )
+        for fila in min_fechas_df.to_dict("records")
+    ]
+    fechas_iniciales = [
+        datetime(anio, mes, 1) for anio, mes in zip(min_fechas_df['min_Anio'].tolist(), min_fechas_df['min_Mes'].tolist())
+    ]
+
+    # Cada bloque agrupa varias combinaciones completas para no superar tamano_lote filas por llamada al modelo
+    combinaciones_por_lote = max(1, tamano_lote // horizonte)
+    for inicio in range(0, len(combinaciones), combinaciones_por_lote):
+        fin = min(inicio + combinaciones_por_lote, len(combinaciones))
+        items = [
+            (modelapi.calcular_fechas(fechas_iniciales[i], horizonte), combinaciones[i])
+            for i in range(inicio, fin)
+        ]
+        predicciones, errores = modelapi.predecir_columnas(modelapi.construir_columnas_lote(items))
+
+        # Las filas con error quedan en NaN y la API las resolverá con el modelo
+        predicciones = [np.nan if prediccion is None else prediccion for prediccion in predicciones]
+        tabla[inicio:fin] = np.array(predicciones, dtype=np.float32).reshape(fin - inicio, horizonte)
+        if errores:
+            logger.error(f"{len(errores)} filas con error entre las combinaciones {inicio} y {fin}")
+
+        logger.info(f"Combinaciones precalculadas: {fin} de {len(combinaciones)}")
+
+    return tabla
+
+
+# Función para guardar la tabla y sus metadatos; se escribe en archivos temporales y luego se reemplazan
+def guardar_tabla(tabla):
+    ruta_tmp = modelapi.ruta_precalculadas + ".tmp"
+    with open(ruta_tmp, "wb") as file:
+        np.save(file, tabla)
+
+    meta = {
+        "horizonte": int(tabla.shape[1]),
+        "combinaciones": int(tabla.shape[0]),
+        "hash_modelo": modelapi.hash_archivo(modelapi.ruta_modelo),
+        "hash_min_fechas": modelapi.hash_archivo(modelapi.ruta_min_fechas),
+        "fecha_generacion": datetime.now().isoformat()
+    }
+    ruta_meta_tmp = modelapi.ruta_meta_precalculadas + ".tmp"
+    with open(ruta_meta_tmp, "w") as file:
+        json.dump(meta, file, indent=2)
+
+    os.replace(ruta_tmp, modelapi.ruta_precalculadas)
+    os.replace(ruta_meta_tmp, modelapi.ruta_meta_precalculadas)
+    logger.info(f"Tabla de predicciones precalculadas guardada en {modelapi.ruta_precalculadas}")
+
+
+if __name__ == "__main__":
+    # Con carga diferida en config.yml los artefactos no se cargan al importar la API
+    if modelapi.modelo is None:
+        modelapi.cargar_artefactos()
+
+    config_precalculadas = modelapi.config.get("precalculadas", {})
+
+    parser = argparse.ArgumentParser(description="Precalcular las predicciones de todas las combinaciones para la API")
+    parser.add_argument("--horizonte", type=int, default=config_precalculadas.get("horizonte", 24),
+                        help="Número de meses a precalcular por combinación")
+    parser.add_argument("--tamano-lote", type=int, default=modelapi.config.get("batch", {}).get("tamano_lote", 5000),
+                        help="Número máximo de filas por llamada al modelo")
+    args = parser.parse_args()
+
+    guardar_tabla(precalcular(args.horizonte, args.tamano_lote))
@@ -1 +1,10 @@
-uvicorn modelapi:app --host 0.0.0.0 --port $PORT
\ No newline at end of file
+#!/bin/bash
+# WORKERS > 1 inicia varios procesos con gunicorn; --preload carga el modelo y las tablas una sola vez
+# antes del fork, y los workers los comparten copy-on-write
+WORKERS=${WORKERS:-1}
+
+if [ "$WORKERS" -gt 1 ]; then
+    gunicorn modelapi:app --worker-class uvicorn.workers.UvicornWorker --workers $WORKERS --preload --bind 0.0.0.0:$PORT
+else
+    uvicorn modelapi:app --host 0.0.0.0 --port $PORT
+fi
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from codificador_rapido import CodificadorRapido, datos_min_fechas, verificar_paridad
+
+carpeta = Path(__file__).parent
+
+
+@pytest.fixture(scope="module")
+def modelo():
+    return joblib.load(carpeta / "mejor_modelo.pkl")
+
+
+@pytest.fixture(scope="module")
+def codificador(modelo):
+    return CodificadorRapido(modelo)
+
+
+@pytest.fixture(scope="module")
+def min_fechas_df():
+    return pd.read_csv(carpeta / "min_fechas_predicciones.csv")
+
+
+def comprobar_paridad(codificador, modelo, datos):
+    iguales, esperado, obtenido = verificar_paridad(codificador, modelo, datos)
+    assert iguales, f"Filas con diferencias: {np.flatnonzero(esperado != obtenido)[:10]}"
+
+
+# Todas las combinaciones con los códigos de producto como texto (como llegan a la API) y como enteros
+@pytest.mark.parametrize("tipo_codigo", [str, int])
+def test_paridad_combinaciones(codificador, modelo, min_fechas_df, tipo_codigo):
+    comprobar_paridad(codificador, modelo, datos_min_fechas(min_fechas_df, tipo_codigo))
+
+
+# Categorías que el OneHotEncoder no vio al entrenar, en cada columna por separado y todas juntas
+valores_nuevos = {
+    "Uen": "UEN NUEVA",
+    "Regional": "REGIONAL NUEVA",
+    "Canal Comercial": "Canal Nuevo",
+    "Marquilla": "MARCA999",
+    "Código Producto": "99999999",
+    "Producto": "PRODUCTO NUEVO",
+}
+
+
+@pytest.mark.parametrize("columnas", [[columna] for columna in valores_nuevos] + [list(valores_nuevos)])
+@pytest.mark.parametrize("tipo_codigo", [str, int])
+def test_paridad_categorias_desconocidas(codificador, modelo, min_fechas_df, columnas, tipo_codigo):
+    datos = datos_min_fechas(min_fechas_df.head(200), tipo_codigo)
+    for columna in columnas:
+        valor = tipo_codigo(valores_nuevos[columna]) if columna == "Código Producto" else valores_nuevos[columna]
+        # Se reemplaza una de cada dos filas, para mezclar categorías conocidas y desconocidas
+        datos[columna] = [valor if i % 2 == 0 else original for i, original in enumerate(datos[columna])]
+    comprobar_paridad(codificador, modelo, datos)
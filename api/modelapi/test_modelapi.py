@@ -0,0 +1,60 @@
+import importlib
+import os
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+carpeta = Path(__file__).parent
+
+
+# La API usa rutas relativas (artefactos y carpeta logs): se inicia desde una carpeta temporal con enlaces a los
+# artefactos, para no escribir en los logs del repositorio
+@pytest.fixture(scope="module")
+def modelapi(tmp_path_factory):
+    directorio = tmp_path_factory.mktemp("modelapi")
+    for nombre in ("mejor_modelo.pkl", "config.yml", "min_fechas_predicciones.csv"):
+        (directorio / nombre).symlink_to(carpeta / nombre)
+    anterior = os.getcwd()
+    os.chdir(directorio)
+    try:
+        yield importlib.import_module("modelapi")
+    finally:
+        os.chdir(anterior)
+
+
+@pytest.fixture(scope="module")
+def cliente(modelapi):
+    with TestClient(modelapi.app, raise_server_exceptions=False) as cliente:
+        yield cliente
+
+
+solicitud_base = {
+    "Uen": "ACC PARA PINTAR",
+    "Regional": "REGIONAL BARRANQUILLA",
+    "Canal_Comercial": "Cadenas y Grandes Superficies",
+    "Marquilla": "PINTUCO",
+    "Codigo_Producto": "10375582",
+    "Producto": "BROCHA ESTANDAR CERDA BLANCA 2 PULG PINTUCO",
+    "meses_a_proyectar": 3,
+}
+
+
+def test_predict_responde(cliente):
+    respuesta = cliente.post("/predict/", json=solicitud_base)
+    assert respuesta.status_code == 200
+    assert len(respuesta.json()["result"]) == 3
+
+
+# Las solicitudes que terminan en una excepción también se cuentan como 500 y se miden en el histograma
+@pytest.mark.parametrize("cambios", [{"Uen": "UEN NUEVA"}, {"Codigo_Producto": "no-numerico"}])
+def test_metricas_registran_errores_500(modelapi, cliente, cambios):
+    solicitudes_antes = modelapi.solicitudes_total.series.get(("/predict/", 500), 0)
+    serie = modelapi.latencia_solicitudes.series.get(("/predict/",))
+    latencias_antes = sum(serie["cuentas"]) if serie else 0
+
+    respuesta = cliente.post("/predict/", json=dict(solicitud_base, **cambios))
+
+    assert respuesta.status_code == 500
+    assert modelapi.solicitudes_total.series[("/predict/", 500)] == solicitudes_antes + 1
+    assert sum(modelapi.latencia_solicitudes.series[("/predict/",)]["cuentas"]) == latencias_antes + 1
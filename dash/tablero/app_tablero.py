@@ -1,16 +1,27 @@
 import dash
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.graph_objs as go
 import numpy as np
 import pandas as pd
 import datetime as dt
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
+import glob
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, wraps
 from loguru import logger
 
+# Copy-on-write: los subconjuntos de un dataframe son vistas de solo lectura y modificarlos nunca altera el original
+pd.options.mode.copy_on_write = True
+
 app = dash.Dash(
     __name__,
     meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
@@ -25,27 +36,499 @@ api_url = os.getenv('API_URL')
 #api_url = '52.21.110.235'
 api_url = "http://{}:8001/predict".format(api_url)
 
+# Timeouts (segundos) de conexión y de lectura de las llamadas a la API de predicción
+timeout_api = (float(os.getenv('API_TIMEOUT_CONEXION', 3)), float(os.getenv('API_TIMEOUT_LECTURA', 30)))
+
+# Memoria compartida entre procesos (varios workers de gunicorn): el cubo de ventas se escribe una vez en archivos
+# .npy y cada proceso los abre con np.load(mmap_mode='r'), así el sistema operativo comparte las mismas páginas
+# y la memoria no se multiplica por el número de workers
+memoria_compartida = os.getenv('DASH_MEMORIA_COMPARTIDA', '0') == '1'
+ruta_memoria_compartida = os.getenv('DASH_DIR_COMPARTIDO', './compartido')
+
+# Número de combinaciones de filtros memorizadas por cada callback
+tamano_cache_callbacks = 128
+
+# Límites de tamaño de las figuras: categorías por gráfico (el resto se agrupa en "Otros") y puntos por serie
+max_categorias_graficos = 12
+max_puntos_serie = 500
+
+# El pronóstico se calcula en un callback en segundo plano (DiskcacheManager), para no ocupar un worker de gunicorn
+# durante la llamada a la API. Si una nueva selección llega antes de terminar, el trabajo anterior se cancela (cancel=)
+# y gana la última. Si diskcache/multiprocess/psutil no están instalados se usa un callback normal.
+ruta_cache_tablero = os.getenv('DASH_CACHE_DIR', './cache')
+# Tiempo (segundos) que se guardan las predicciones, en el cache en disco compartido entre los procesos del callback
+# en segundo plano y en el de cada proceso, para que un modelo nuevo en la API se refleje en el tablero
+expiracion_cache_predicciones = 600
+try:
+    import diskcache
+    import multiprocess  # noqa: F401 (requerido por DiskcacheManager)
+    import psutil
+
+    # Cuando el trabajo termina justo al leer su resultado, el proceso puede desaparecer mientras Dash lo termina
+    # (psutil.NoSuchProcess) y la solicitud fallaba con error 500; en ese caso el trabajo ya está terminado
+    class ManagerTablero(dash.DiskcacheManager):
+        def terminate_job(self, job):
+            try:
+                super().terminate_job(job)
+            except psutil.NoSuchProcess:
+                pass
+
+    cache_tablero = diskcache.Cache(ruta_cache_tablero)
+    background_callback_manager = ManagerTablero(cache_tablero)
+except ImportError:
+    logger.warning("diskcache/multiprocess/psutil no disponibles, el pronóstico se calcula en el callback normal")
+    cache_tablero = None
+    background_callback_manager = None
+
+# Datos del tablero: Parquet (se genera con convertir_datos.py) y el CSV de la capa gold como respaldo
+ruta_datos_parquet = "ExporteCOL2022_2023_2024_top_products.parquet"
+ruta_datos_csv = "ExporteCOL2022_2023_2024_top_products.csv"
+
+# Columnas que usa el tablero (el resto del archivo no se carga). Las de texto se cargan como categóricas.
+columnas_texto = ["Uen", "Regional", "Canal Comercial", "Marquilla", "Producto"]
+columnas_tablero = ["Año", "Mes", "Uen", "Regional", "Canal Comercial", "Marquilla", "Código Producto", "Producto",
+                    "Ventas", "Ventas Galones", "Utilidad Bruta", "Margen"]
+
+
 # Load data from gold folder
 def load_data_analisis_descriptivo():
-    data = pd.read_csv("ExporteCOL2022_2023_2024_top_products.csv", sep=',')
+    if os.path.exists(ruta_datos_parquet):
+        try:
+            import pyarrow.parquet as pq
+            # read_dictionary mantiene la codificación por diccionario de Parquet como columnas categóricas
+            tabla = pq.read_table(ruta_datos_parquet, columns=columnas_tablero, read_dictionary=columnas_texto)
+            logger.info("Datos cargados desde {}".format(ruta_datos_parquet))
+            return tabla.to_pandas()
+        except ImportError:
+            logger.warning("pyarrow no disponible, se cargan los datos desde {}".format(ruta_datos_csv))
+
+    data = pd.read_csv(ruta_datos_csv, sep=',', usecols=columnas_tablero, dtype={columna: "category" for columna in columnas_texto})
     #data = pd.read_csv("ExporteCOL2022_2023_2024_top_products.csv", sep=',')
     return data
     
 
+# Función para construir las fechas (primer día de cada mes) a partir de columnas de año y mes
+def construir_fechas(anios, meses):
+    return pd.to_datetime(pd.DataFrame({"year": np.asarray(anios, dtype=int), "month": np.asarray(meses, dtype=int), "day": 1}))
+
+
+# Preparar los datos una sola vez al cargar: tipos de Año y Mes (las fechas del cubo se calculan por período)
+def preparar_datos(data):
+    data["Año"] = data["Año"].astype(int)
+    data["Mes"] = data["Mes"].astype(int)
+    return data
+
+
+# Dimensiones y medidas del cubo de ventas
+dimensiones_cubo = ["Año", "Mes", "Uen", "Regional", "Canal Comercial", "Marquilla", "Código Producto", "Producto"]
+medidas_cubo = ["Ventas", "Ventas Galones", "Utilidad Bruta", "Margen"]
+
+# Dimensiones de los filtros de los KPIs y columnas de las sumas parciales por celda que usan
+dimensiones_kpi = ["Año", "Mes", "Uen", "Regional", "Canal Comercial", "Marquilla", "Producto"]
+columnas_parciales = ["Ventas", "Ventas Galones", "Utilidad Bruta", "Filas"]
+
+
+# Construir el cubo de ventas: sumas y conteos por cada combinación de dimensiones, con las dimensiones
+# guardadas como códigos enteros. Los callbacks filtran y suman el cubo en lugar de agrupar todos los datos.
+def construir_cubo(data):
+    codigos = {}
+    categorias = {}
+    for dimension in dimensiones_cubo:
+        codigos_dimension, categorias_dimension = pd.factorize(data[dimension], sort=True)
+        codigos[dimension] = codigos_dimension.astype(np.int32)
+        categorias[dimension] = np.asarray(categorias_dimension)
+
+    # El período (AAAAMM) se usa para agrupar las series de tiempo
+    codigos_periodo, periodos = pd.factorize(data["Año"] * 100 + data["Mes"], sort=True)
+
+    celdas = pd.DataFrame(codigos)
+    celdas["Periodo"] = codigos_periodo.astype(np.int32)
+    for medida in medidas_cubo:
+        celdas[medida] = data[medida].to_numpy()
+
+    agrupado = celdas.groupby(dimensiones_cubo + ["Periodo"], sort=False)
+    sumas = agrupado[medidas_cubo].sum().reset_index()
+    conteos = agrupado["Margen"].agg(["size", "count"]).reset_index(drop=True)
+
+    cubo = {
+        "categorias": categorias,
+        "indices": indices_categorias(categorias),
+        # Códigos de cada dimensión en el orden en que aparecen en los datos, para las opciones de los dropdowns
+        "orden": {dimension: pd.unique(codigos[dimension][codigos[dimension] >= 0]) for dimension in dimensiones_cubo},
+        "periodos": np.asarray(periodos),
+        "fechas": construir_fechas(periodos // 100, periodos % 100).to_numpy(),  # Fecha de cada período
+        "codigos": {dimension: sumas[dimension].to_numpy(dtype=np.int32) for dimension in dimensiones_cubo + ["Periodo"]},
+        "medidas": {medida: sumas[medida].to_numpy(dtype=np.float64) for medida in medidas_cubo},
+        "filas": conteos["size"].to_numpy(dtype=np.int32),
+        "filas_margen": conteos["count"].to_numpy(dtype=np.int32),  # Filas con Margen no nulo, para el promedio
+    }
+
+    # Sumas parciales de los KPIs por celda, en una sola matriz (celdas x columnas_parciales)
+    cubo["parciales"] = np.column_stack([cubo["medidas"]["Ventas"], cubo["medidas"]["Ventas Galones"],
+                                         cubo["medidas"]["Utilidad Bruta"], cubo["filas"].astype(np.float64)])
+
+    # Índice invertido por dimensión: las celdas ordenadas por código y la posición donde empieza cada código,
+    # así las celdas de un valor son celdas[inicios[codigo + 1]:inicios[codigo + 2]] (el código -1 va primero)
+    cubo["celdas"] = {}
+    cubo["inicios"] = {}
+    for dimension in dimensiones_kpi:
+        codigos_celdas = cubo["codigos"][dimension]
+        cubo["celdas"][dimension] = np.argsort(codigos_celdas, kind="stable").astype(np.int32)
+        conteo_codigos = np.bincount(codigos_celdas + 1, minlength=len(categorias[dimension]) + 1)
+        cubo["inicios"][dimension] = np.concatenate(([0], np.cumsum(conteo_codigos)))
+
+    logger.info("Cubo de ventas construido: {} filas en {} celdas".format(len(data), len(cubo["filas"])))
+    return cubo
+
+
+# Diccionario valor -> código por dimensión, para traducir los valores de los filtros
+def indices_categorias(categorias):
+    return {dimension: {valor: codigo for codigo, valor in enumerate(categorias[dimension].tolist())} for dimension in dimensiones_cubo}
+
+
+# Arreglos del cubo que se guardan en archivos .npy: (grupo, llave), con grupo None para los arreglos sueltos
+def arreglos_cubo():
+    return ([("orden", dimension) for dimension in dimensiones_cubo] + [(None, "periodos"), (None, "fechas")] +
+            [("codigos", dimension) for dimension in dimensiones_cubo + ["Periodo"]] +
+            [("medidas", medida) for medida in medidas_cubo] + [(None, "filas"), (None, "filas_margen"), (None, "parciales")] +
+            [("celdas", dimension) for dimension in dimensiones_kpi] + [("inicios", dimension) for dimension in dimensiones_kpi])
+
+
+# Huella del archivo de datos del que sale el cubo, para saber si los archivos compartidos siguen vigentes
+def huella_datos():
+    ruta = ruta_datos_parquet if os.path.exists(ruta_datos_parquet) else ruta_datos_csv
+    estado = os.stat(ruta)
+    return {"ruta": ruta, "tamano": estado.st_size, "mtime": estado.st_mtime_ns}
+
+
+# Escribir el cubo en el directorio compartido. Cada archivo se escribe a un temporal y se renombra, y el
+# manifiesto (cubo.json) se escribe al final, así ningún proceso lee un cubo a medio escribir.
+def guardar_cubo(cubo, directorio, huella):
+    os.makedirs(directorio, exist_ok=True)
+    version = hashlib.sha256(json.dumps(huella, sort_keys=True).encode()).hexdigest()[:16]
+    sufijo_temporal = ".tmp{}".format(os.getpid())
+
+    for i, (grupo, llave) in enumerate(arreglos_cubo()):
+        arreglo = cubo[llave] if grupo is None else cubo[grupo][llave]
+        ruta = os.path.join(directorio, "cubo-{}-{}.npy".format(version, i))
+        with open(ruta + sufijo_temporal, "wb") as archivo:
+            np.save(archivo, np.ascontiguousarray(arreglo))
+        os.replace(ruta + sufijo_temporal, ruta)
+
+    manifiesto = {
+        "version": version,
+        "huella": huella,
+        "categorias": {dimension: cubo["categorias"][dimension].tolist() for dimension in dimensiones_cubo},
+    }
+    ruta_manifiesto = os.path.join(directorio, "cubo.json")
+    with open(ruta_manifiesto + sufijo_temporal, "w", encoding="utf-8") as archivo:
+        json.dump(manifiesto, archivo, ensure_ascii=False)
+    os.replace(ruta_manifiesto + sufijo_temporal, ruta_manifiesto)
+
+    # Borrar versiones anteriores (los procesos que aún las tengan mapeadas siguen funcionando)
+    for ruta in glob.glob(os.path.join(directorio, "cubo-*.npy")):
+        if not os.path.basename(ruta).startswith("cubo-{}-".format(version)):
+            os.remove(ruta)
+    logger.info("Cubo de ventas guardado en {} (versión {})".format(directorio, version))
+
+
+# Abrir el cubo del directorio compartido como archivos mapeados en memoria de solo lectura.
+# Devuelve None si no existe o si fue construido con otro archivo de datos.
+def cargar_cubo_compartido(directorio, huella):
+    try:
+        with open(os.path.join(directorio, "cubo.json"), encoding="utf-8") as archivo:
+            manifiesto = json.load(archivo)
+        if manifiesto["huella"] != huella:
+            return None
+
+        categorias = {dimension: np.asarray(pd.Index(valores)) for dimension, valores in manifiesto["categorias"].items()}
+        cubo = {"categorias": categorias, "indices": indices_categorias(categorias)}
+        for i, (grupo, llave) in enumerate(arreglos_cubo()):
+            arreglo = np.load(os.path.join(directorio, "cubo-{}-{}.npy".format(manifiesto["version"], i)), mmap_mode="r")
+            if grupo is None:
+                cubo[llave] = arreglo
+            else:
+                cubo.setdefault(grupo, {})[llave] = arreglo
+    except FileNotFoundError:
+        return None
+
+    logger.info("Cubo de ventas abierto desde {} (versión {})".format(directorio, manifiesto["version"]))
+    return cubo
+
+
+# Obtener el cubo de ventas: en modo de memoria compartida se abre el del directorio compartido, o se construye,
+# se guarda y se vuelve a abrir mapeado (así este proceso tampoco se queda con una copia privada)
+def obtener_cubo():
+    if not memoria_compartida:
+        return construir_cubo(preparar_datos(load_data_analisis_descriptivo()))
+
+    huella = huella_datos()
+    cubo = cargar_cubo_compartido(ruta_memoria_compartida, huella)
+    if cubo is None:
+        guardar_cubo(construir_cubo(preparar_datos(load_data_analisis_descriptivo())), ruta_memoria_compartida, huella)
+        cubo = cargar_cubo_compartido(ruta_memoria_compartida, huella)
+    return cubo
+
+
+# Máscara de las celdas del cubo que cumplen los filtros (dimensión -> lista de valores permitidos)
+def mascara_cubo(cubo, filtros):
+    codigos = [[cubo["indices"][dimension][valor] for valor in valores if valor in cubo["indices"][dimension]]
+               for dimension, valores in filtros.items()]
+    return mascara_cubo_codigos(cubo, filtros.keys(), codigos)
+
+
+# Máscara de las celdas a partir de los códigos permitidos de cada dimensión
+def mascara_cubo_codigos(cubo, dimensiones, codigos_dimensiones):
+    mascara = np.ones(len(cubo["filas"]), dtype=bool)
+    for dimension, codigos in zip(dimensiones, codigos_dimensiones):
+        mascara &= codigos_permitidos(cubo, dimension, codigos)[cubo["codigos"][dimension]]
+    return mascara
+
+
+# Arreglo booleano por código de una dimensión. La posición extra al final corresponde al código -1
+# de los valores nulos, que nunca cumplen el filtro.
+def codigos_permitidos(cubo, dimension, codigos):
+    permitidos = np.zeros(len(cubo["categorias"][dimension]) + 1, dtype=bool)
+    permitidos[list(codigos)] = True
+    return permitidos
+
+
+# Suma de una medida por cada valor de una dimensión (o por período), solo en las celdas de la máscara
+def sumar_por(cubo, mascara, dimension, medida):
+    codigos = cubo["codigos"][dimension]
+    seleccion = mascara & (codigos >= 0)
+    n_categorias = len(cubo["periodos"]) if dimension == "Periodo" else len(cubo["categorias"][dimension])
+
+    if medida == "Filas":
+        sumas = np.bincount(codigos[seleccion], weights=cubo["filas"][seleccion], minlength=n_categorias)
+    elif medida == "Filas Margen":
+        sumas = np.bincount(codigos[seleccion], weights=cubo["filas_margen"][seleccion], minlength=n_categorias)
+    else:
+        sumas = np.bincount(codigos[seleccion], weights=cubo["medidas"][medida][seleccion], minlength=n_categorias)
+    # Solo se devuelven los valores con filas, igual que un groupby
+    presentes = np.bincount(codigos[seleccion], minlength=n_categorias) > 0
+    return np.flatnonzero(presentes), sumas[presentes]
+
+
+# Totales de las medidas en las celdas de la máscara
+def totales_cubo(cubo, mascara):
+    return totales_a_dict(cubo["parciales"][mascara].sum(axis=0))
+
+
+def totales_a_dict(sumas):
+    totales = dict(zip(columnas_parciales, sumas.tolist()))
+    totales["Filas"] = int(totales["Filas"])
+    return totales
+
+
+# Motor de KPIs incremental. Guarda los totales de los últimos filtros consultados; para unos filtros nuevos parte
+# del estado guardado más parecido y, dimensión por dimensión, suma las celdas de los valores que se agregaron y
+# resta las de los valores que se quitaron (usando el índice invertido del cubo), en lugar de recorrer todo el cubo.
+# Si el cambio toca más celdas de las que tiene el cubo completo, se recalcula con una máscara.
+class MotorKPI:
+    def __init__(self, cubo, max_estados=32, estados_candidatos=4):
+        self.cubo = cubo
+        self.max_estados = max_estados
+        self.estados_candidatos = estados_candidatos  # Estados más recientes que se evalúan como punto de partida
+        self.n_celdas = len(cubo["filas"])
+        self.estados = OrderedDict()  # tupla de conjuntos de códigos por dimensión -> sumas parciales
+        self.lock = threading.Lock()
+        # Número de celdas de cada código por dimensión
+        self.celdas_por_codigo = {dimension: np.diff(cubo["inicios"][dimension])[1:].tolist() for dimension in dimensiones_kpi}
+
+    # Códigos de los valores de cada dimensión (los valores que no existen se ignoran)
+    def codigos_filtros(self, filtros):
+        return tuple(frozenset(map(self.cubo["indices"][dimension].get, filtros[dimension])) - {None}
+                     for dimension in dimensiones_kpi)
+
+    # Número de celdas de un conjunto de códigos de una dimensión
+    def celdas_codigos(self, dimension, codigos):
+        celdas_por_codigo = self.celdas_por_codigo[dimension]
+        return sum(celdas_por_codigo[codigo] for codigo in codigos)
+
+    # Celdas con alguno de los códigos dados en la dimensión, y que cumplen los filtros en las demás dimensiones
+    def celdas_delta(self, dimension, codigos, filtros):
+        inicios = self.cubo["inicios"][dimension]
+        celdas = np.concatenate([self.cubo["celdas"][dimension][inicios[codigo + 1]:inicios[codigo + 2]] for codigo in codigos]
+                                + [np.empty(0, dtype=np.int32)])
+        for j, otra in enumerate(dimensiones_kpi):
+            if otra != dimension:
+                celdas = celdas[codigos_permitidos(self.cubo, otra, filtros[j])[self.cubo["codigos"][otra][celdas]]]
+        return celdas
+
+    def totales(self, filtros):
+        clave = self.codigos_filtros(filtros)
+        with self.lock:
+            if clave in self.estados:
+                self.estados.move_to_end(clave)
+                return totales_a_dict(self.estados[clave])
+            estados = list(self.estados.items())[-self.estados_candidatos:]
+
+        # Estado reciente más cercano: el que requiere sumar/restar menos celdas
+        mejor_costo, mejor_estado = self.n_celdas, None
+        for clave_estado, sumas_estado in estados:
+            costo = sum(self.celdas_codigos(dimension, anterior ^ nuevo)
+                        for dimension, anterior, nuevo in zip(dimensiones_kpi, clave_estado, clave) if anterior != nuevo)
+            if costo < mejor_costo:
+                mejor_costo, mejor_estado = costo, (clave_estado, sumas_estado)
+
+        if mejor_estado is None:
+            sumas = self.cubo["parciales"][mascara_cubo_codigos(self.cubo, dimensiones_kpi, clave)].sum(axis=0)
+        else:
+            actual, sumas = list(mejor_estado[0]), mejor_estado[1].copy()
+            for j, dimension in enumerate(dimensiones_kpi):
+                if actual[j] == clave[j]:
+                    continue
+                agregados, quitados = clave[j] - actual[j], actual[j] - clave[j]
+                sumas += self.cubo["parciales"][self.celdas_delta(dimension, agregados, actual)].sum(axis=0)
+                sumas -= self.cubo["parciales"][self.celdas_delta(dimension, quitados, actual)].sum(axis=0)
+                actual[j] = clave[j]
+            # Si no quedan filas los totales son exactamente cero (sin residuos de las restas)
+            if sumas[columnas_parciales.index("Filas")] == 0:
+                sumas[:] = 0
+
+        with self.lock:
+            self.estados[clave] = sumas
+            if len(self.estados) > self.max_estados:
+                self.estados.popitem(last=False)
+        return totales_a_dict(sumas)
+
+
+# Serie de una medida sumada por fecha (primer día de cada mes), ordenada por fecha
+def serie_por_fecha(cubo, mascara, medida):
+    codigos_periodo, valores = sumar_por(cubo, mascara, "Periodo", medida)
+    return cubo["fechas"][codigos_periodo], valores
+
+
+# Ventas por valor de una dimensión sobre todo el cubo, ordenadas de mayor a menor
+def ventas_por(cubo, dimension):
+    codigos, ventas = sumar_por(cubo, np.ones(len(cubo["filas"]), dtype=bool), dimension, "Ventas")
+    orden = np.argsort(-ventas, kind="stable")
+    return cubo["categorias"][dimension][codigos[orden]], ventas[orden]
+
+
+# Valores de una dimensión en el orden en que aparecen en los datos (opciones de los dropdowns)
+def valores_dimension(cubo, dimension):
+    return cubo["categorias"][dimension][cubo["orden"][dimension]]
+
+
 # Cargar datos
 #data = load_data()
-data_ad = load_data_analisis_descriptivo()
+cubo_ventas = obtener_cubo()
+motor_kpi = MotorKPI(cubo_ventas)
+
+
+# Función para limitar el número de categorías de un gráfico: se conservan las primeras (los valores vienen
+# ordenados de mayor a menor) y el resto se suma en una categoría "Otros"
+def agrupar_otros(categorias, valores, max_categorias=max_categorias_graficos):
+    if len(categorias) <= max_categorias:
+        return categorias, valores
+    categorias = np.append(categorias[:max_categorias - 1], "Otros")
+    valores = np.append(valores[:max_categorias - 1], valores[max_categorias - 1:].sum())
+    return categorias, valores
+
+
+# Función para reducir una serie larga a max_puntos con LTTB (Largest-Triangle-Three-Buckets): se conservan el
+# primer y el último punto, y de cada bucket intermedio el punto que forma el triángulo de mayor área con el punto
+# elegido antes y el promedio del bucket siguiente, así se mantienen los picos y la forma de la serie
+def reducir_serie(x, y, max_puntos=max_puntos_serie):
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= max_puntos or max_puntos < 3:
+        return x, y
+
+    # Las fechas se usan como enteros para calcular las áreas
+    x_numerico = (x.astype("datetime64[ns]").astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x).astype(np.float64)
+    bordes = np.linspace(1, n - 1, max_puntos - 1).astype(np.int64)
+
+    seleccion = [0]
+    for i in range(max_puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        # El último bucket usa el último punto de la serie como "bucket siguiente"
+        siguiente = slice(fin, bordes[i + 2]) if i + 2 < len(bordes) else slice(n - 1, n)
+        x_siguiente, y_siguiente = x_numerico[siguiente].mean(), y[siguiente].mean()
+        x_anterior, y_anterior = x_numerico[seleccion[-1]], y[seleccion[-1]]
+
+        areas = np.abs((x_anterior - x_siguiente) * (y[inicio:fin] - y_anterior) -
+                       (x_anterior - x_numerico[inicio:fin]) * (y_siguiente - y_anterior))
+        areas[np.isnan(areas)] = -1
+        seleccion.append(inicio + int(np.argmax(areas)))
+    seleccion.append(n - 1)
+    return x[seleccion], y[seleccion]
+
+
+# Jerarquía de las combinaciones de la predicción: Uen -> Regional -> Canal -> Marquilla -> Código -> Producto.
+# Para cada prefijo de códigos se guardan los códigos del nivel siguiente, así los dropdowns de la predicción
+# solo ofrecen combinaciones que existen y cada consulta es un acceso a diccionario.
+niveles_jerarquia = ["Uen", "Regional", "Canal Comercial", "Marquilla", "Código Producto", "Producto"]
+ids_jerarquia = ["uen-prediccion", "regional-prediccion", "canal-prediccion", "marquilla-prediccion", "codigo-prediccion", "producto-prediccion"]
+
+
+def construir_jerarquia(cubo):
+    codigos = np.column_stack([cubo["codigos"][nivel] for nivel in niveles_jerarquia])
+    combinaciones = np.unique(codigos[(codigos >= 0).all(axis=1)], axis=0)
+
+    hijos = {}
+    for nivel in range(len(niveles_jerarquia)):
+        for combinacion in set(map(tuple, combinaciones[:, :nivel + 1].tolist())):
+            hijos.setdefault(combinacion[:nivel], []).append(combinacion[nivel])
+
+    # Los hijos se ordenan según el orden de aparición de su dimensión en los datos
+    posiciones = []
+    for nivel in niveles_jerarquia:
+        posicion = np.empty(len(cubo["categorias"][nivel]), dtype=np.int64)
+        posicion[cubo["orden"][nivel]] = np.arange(len(cubo["orden"][nivel]))
+        posiciones.append(posicion.tolist())
+    for prefijo, codigos_hijos in hijos.items():
+        codigos_hijos.sort(key=posiciones[len(prefijo)].__getitem__)
+    logger.info("Jerarquía de predicción construida: {} combinaciones".format(len(combinaciones)))
+    return hijos
+
+
+jerarquia_prediccion = construir_jerarquia(cubo_ventas)
+
 
-def plot_bar_1(data_ad):
+# Valores válidos del siguiente nivel de la jerarquía, dados los valores de los niveles anteriores
+def opciones_jerarquia(*valores_padres):
+    prefijo = []
+    for nivel, valor in zip(niveles_jerarquia, valores_padres):
+        codigo = cubo_ventas["indices"][nivel].get(valor)
+        if codigo is None:
+            return []
+        prefijo.append(codigo)
+    categorias = cubo_ventas["categorias"][niveles_jerarquia[len(prefijo)]]
+    return categorias[jerarquia_prediccion.get(tuple(prefijo), [])].tolist()
 
-    ventas_por_canal = data_ad.groupby("Canal Comercial")["Ventas"].sum().reset_index()
-    ventas_por_canal = ventas_por_canal.sort_values(by="Ventas", ascending=False)
+
+# Función para verificar que una combinación de la predicción existe en los datos
+def combinacion_existe(uen_p, regional_p, canal, marq_p, codigo_p, producto_p):
+    return producto_p in opciones_jerarquia(uen_p, regional_p, canal, marq_p, codigo_p)
+
+
+# Selección inicial de los dropdowns de la predicción: la primera opción válida de cada nivel
+def seleccion_inicial_jerarquia():
+    seleccion = []
+    opciones = []
+    for _ in niveles_jerarquia:
+        opciones_nivel = opciones_jerarquia(*seleccion)
+        opciones.append(opciones_nivel)
+        seleccion.append(opciones_nivel[0] if opciones_nivel else None)
+    return seleccion, opciones
+
+
+seleccion_inicial, opciones_iniciales = seleccion_inicial_jerarquia()
+
+
+def plot_bar_1(cubo):
+
+    canales, ventas = agrupar_otros(*ventas_por(cubo, "Canal Comercial"))
 
     fig = go.Figure(
         data=[
             go.Bar(
-                x=ventas_por_canal["Canal Comercial"],
-                y=ventas_por_canal["Ventas"],
+                x=canales,
+                y=ventas,
                 marker=dict(color="#3498db"),
                 name="Ventas por Canal"
             )
@@ -64,17 +547,16 @@ def plot_bar_1(data_ad):
 
     return fig
 
-def plot_bar_2(data_ad):
+def plot_bar_2(cubo):
 
-    ventas_por_marquilla = data_ad.groupby("Marquilla")["Ventas"].sum().reset_index()
-    ventas_por_marquilla = ventas_por_marquilla.sort_values(by="Ventas", ascending=False)
-    ventas_por_marquilla = ventas_por_marquilla.head(10)
+    marquillas, ventas = ventas_por(cubo, "Marquilla")
+    marquillas, ventas = marquillas[:10], ventas[:10]
 
     fig = go.Figure(
         data=[
             go.Bar(
-                x=ventas_por_marquilla["Marquilla"],
-                y=ventas_por_marquilla["Ventas"],
+                x=marquillas,
+                y=ventas,
                 marker=dict(color="#3498db"),
                 name="Ventas por Marquilla"
             )
@@ -93,17 +575,16 @@ def plot_bar_2(data_ad):
 
     return fig
 
-def plot_pie_chart(data_ad):
+def plot_pie_chart(cubo):
 
-    ventas_por_negocio = data_ad.groupby("Uen")["Ventas"].sum().reset_index()
-    ventas_por_negocio = ventas_por_negocio.sort_values(by="Ventas", ascending=False)
+    unidades, ventas = agrupar_otros(*ventas_por(cubo, "Uen"))
 
 
     fig = go.Figure(
         data=[
             go.Pie(
-                labels=ventas_por_negocio["Uen"],
-                values=ventas_por_negocio["Ventas"],
+                labels=unidades,
+                values=ventas,
                 hole=0.25,
                 #marker=dict(colors=["#3498db"]),
                 name="Ventas por Unidad de Negocio"
@@ -139,9 +620,9 @@ def generate_control_card():
                             html.P("UEN"),
                             dcc.Dropdown(
                                 id="uen-prediccion",
-                                options=[{'label': uen, 'value': uen} for uen in data_ad['Uen'].unique()],
+                                options=[{'label': uen, 'value': uen} for uen in opciones_iniciales[0]],
                                 placeholder="Seleccione una Unidad de Negocio",
-                                value=data_ad['Uen'].unique()[0],
+                                value=seleccion_inicial[0],
                                 style=dict(width='50%', minWidth='300px')
                             )
                         ],
@@ -154,9 +635,9 @@ def generate_control_card():
                             html.P("Regional"),
                             dcc.Dropdown(
                                 id="regional-prediccion",
-                                options=[{'label': regional, 'value': regional} for regional in data_ad['Regional'].unique()],
+                                options=[{'label': regional, 'value': regional} for regional in opciones_iniciales[1]],
                                 placeholder="Seleccione una Regional",
-                                value=data_ad['Regional'].unique()[0],
+                                value=seleccion_inicial[1],
                                 style=dict(width='50%', minWidth='300px')
                             )
                         ],
@@ -169,9 +650,9 @@ def generate_control_card():
                             html.P("Canal"),
                             dcc.Dropdown(
                                 id="canal-prediccion",
-                                options=[{'label': canal, 'value': canal} for canal in data_ad['Canal Comercial'].unique()],
+                                options=[{'label': canal, 'value': canal} for canal in opciones_iniciales[2]],
                                 placeholder="Seleccione un canal",
-                                value=data_ad['Canal Comercial'].unique()[0],
+                                value=seleccion_inicial[2],
                                 style=dict(width='50%', minWidth='300px')
                             )
                         ],
@@ -184,9 +665,9 @@ def generate_control_card():
                             html.P("Marquilla"),
                             dcc.Dropdown(
                                 id="marquilla-prediccion",
-                                options=[{'label': marquilla, 'value': marquilla} for marquilla in data_ad['Marquilla'].unique()],
+                                options=[{'label': marquilla, 'value': marquilla} for marquilla in opciones_iniciales[3]],
                                 placeholder="Seleccione una Marquilla",
-                                value=data_ad['Marquilla'].unique()[0],
+                                value=seleccion_inicial[3],
                                 style=dict(width='50%', minWidth='300px')
                             )
                         ],
@@ -199,9 +680,9 @@ def generate_control_card():
                             html.P("Código_producto"),
                             dcc.Dropdown(
                                 id="codigo-prediccion",
-                                options=[{'label': codigo, 'value': codigo} for codigo in data_ad['Código Producto'].unique()],
+                                options=[{'label': codigo, 'value': codigo} for codigo in opciones_iniciales[4]],
                                 placeholder="Seleccione un Código de Producto",
-                                value=data_ad['Código Producto'].unique()[0],
+                                value=seleccion_inicial[4],
                                 style=dict(width='50%', minWidth='300px')
                             )
                         ],
@@ -214,9 +695,9 @@ def generate_control_card():
                             html.P("Producto"),
                             dcc.Dropdown(
                                 id="producto-prediccion",
-                                options=[{'label': producto, 'value': producto} for producto in data_ad['Producto'].unique()],
+                                options=[{'label': producto, 'value': producto} for producto in opciones_iniciales[5]],
                                 placeholder="Seleccione un Producto",
-                                value=data_ad['Producto'].unique()[0],
+                                value=seleccion_inicial[5],
                                 style=dict(width='50%', minWidth='300px')
                             )
                         ],
@@ -267,9 +748,9 @@ def generate_filters():
                             html.P("Año"),
                             dcc.Dropdown(
                                 id="anio-dropdown",
-                                options=[{'label': anio, 'value': anio} for anio in data_ad['Año'].unique()],
+                                options=[{'label': anio, 'value': anio} for anio in valores_dimension(cubo_ventas, 'Año')],
                                 placeholder="Seleccione un Año",
-                                value=[data_ad['Año'].unique()[0]],
+                                value=[valores_dimension(cubo_ventas, 'Año')[0]],
                                 multi = True,
                                 style=dict(width='50%', minWidth='300px')
                             )
@@ -282,9 +763,9 @@ def generate_filters():
                             html.P("Mes"),
                             dcc.Dropdown(
                                 id="mes-dropdown",
-                                options=[{'label': mes, 'value': mes} for mes in data_ad['Mes'].unique()],
+                                options=[{'label': mes, 'value': mes} for mes in valores_dimension(cubo_ventas, 'Mes')],
                                 placeholder="Seleccione uno o varios Mes",
-                                value=[data_ad['Mes'].unique()[0]],
+                                value=[valores_dimension(cubo_ventas, 'Mes')[0]],
                                 multi = True,
                                 style=dict(width='50%', minWidth='300px')
                             )
@@ -297,9 +778,9 @@ def generate_filters():
                             html.P("UEN"),
                             dcc.Dropdown(
                                 id="uen-dropdown",
-                                options=[{'label': uen, 'value': uen} for uen in data_ad['Uen'].unique()],
+                                options=[{'label': uen, 'value': uen} for uen in valores_dimension(cubo_ventas, 'Uen')],
                                 placeholder="Seleccione una Unidad de Negocio",
-                                value=[data_ad['Uen'].unique()[0]],
+                                value=[valores_dimension(cubo_ventas, 'Uen')[0]],
                                 multi = True,
                                 style=dict(width='50%', minWidth='300px')
                             )
@@ -313,9 +794,9 @@ def generate_filters():
                             html.P("Canal"),
                             dcc.Dropdown(
                                 id="canal2-dropdown",
-                                options=[{'label': canal, 'value': canal} for canal in data_ad['Canal Comercial'].unique()],
+                                options=[{'label': canal, 'value': canal} for canal in valores_dimension(cubo_ventas, 'Canal Comercial')],
                                 placeholder="Seleccione un canal",
-                                value=[data_ad['Canal Comercial'].unique()[0]],
+                                value=[valores_dimension(cubo_ventas, 'Canal Comercial')[0]],
                                 multi = True,
                                 style=dict(width='50%', minWidth='300px')
                             )
@@ -329,9 +810,9 @@ def generate_filters():
                             html.P("Regional"),
                             dcc.Dropdown(
                                 id="regional-dropdown",
-                                options=[{'label': regional, 'value': regional} for regional in data_ad['Regional'].unique()],
+                                options=[{'label': regional, 'value': regional} for regional in valores_dimension(cubo_ventas, 'Regional')],
                                 placeholder="Seleccione una Regional",
-                                value=[data_ad['Regional'].unique()[0]],
+                                value=[valores_dimension(cubo_ventas, 'Regional')[0]],
                                 multi = True,
                                 style=dict(width='50%', minWidth='300px')
                             )
@@ -344,9 +825,9 @@ def generate_filters():
                             html.P("Marquilla"),
                             dcc.Dropdown(
                                 id="marquilla-dropdown",
-                                options=[{'label': marquilla, 'value': marquilla} for marquilla in data_ad['Marquilla'].unique()],
+                                options=[{'label': marquilla, 'value': marquilla} for marquilla in valores_dimension(cubo_ventas, 'Marquilla')],
                                 placeholder="Seleccione una Marquilla",
-                                value=[data_ad['Marquilla'].unique()[0]],
+                                value=[valores_dimension(cubo_ventas, 'Marquilla')[0]],
                                 multi = True,
                                 style=dict(width='50%', minWidth='300px')
                             )
@@ -359,9 +840,9 @@ def generate_filters():
                             html.P("Producto"),
                             dcc.Dropdown(
                                 id="producto-dropdown",
-                                options=[{'label': producto, 'value': producto} for producto in data_ad['Producto'].unique()],
+                                options=[{'label': producto, 'value': producto} for producto in valores_dimension(cubo_ventas, 'Producto')],
                                 placeholder="Seleccione un Producto",
-                                value=[data_ad['Producto'].unique()[0]],
+                                value=[valores_dimension(cubo_ventas, 'Producto')[0]],
                                 multi = True,
                                 style=dict(width='50%', minWidth='300px')
                             )
@@ -375,34 +856,21 @@ def generate_filters():
     )
 
 
-def generate_KPI(data_ad):
+def generate_KPI(totales):
     """
     Función para generar 4 KPIs, cada uno en su propia tarjeta.
+    :param totales: Diccionario con las sumas de las medidas, calculado con totales_cubo.
     :return: Una lista de Divs que representan los 4 KPIs.
     """
 
-    if data_ad["Ventas"].sum() >= 1e6:
-        kpi_total_ventas = (data_ad["Ventas"].sum()) #/1e6
-    else: 
-        kpi_total_ventas = (data_ad["Ventas"].sum())
-
-
-    if data_ad["Ventas Galones"].sum() >= 1e6:
-        kpi_total_ventas_gl = (data_ad["Ventas Galones"].sum())  #/1e6
-    else: 
-        kpi_total_ventas_gl = (data_ad["Ventas Galones"].sum())
-
+    kpi_total_ventas = totales["Ventas"]
+    kpi_total_ventas_gl = totales["Ventas Galones"]
+    kpi_utilidad_bruta = totales["Utilidad Bruta"]
 
-    if data_ad["Utilidad Bruta"].sum() >= 1e6:
-        kpi_utilidad_bruta = (data_ad["Utilidad Bruta"].sum())  #/1e6
-    else: 
-        kpi_utilidad_bruta = (data_ad["Utilidad Bruta"].sum())
-
-    
-    if data_ad["Ventas"].sum() == 0:
+    if kpi_total_ventas == 0:
         kpi_margen = 0
     else: 
-        kpi_margen = (data_ad["Utilidad Bruta"].sum() / data_ad["Ventas"].sum())*100
+        kpi_margen = (kpi_utilidad_bruta / kpi_total_ventas)*100
 
 
     return html.Div(
@@ -495,20 +963,16 @@ def generate_KPI(data_ad):
         ]
     )
 
-def plot_time_series_1(data_ad, uen, canal2, regional, marquilla, producto):
-    data_ad['Año'] = data_ad["Año"].astype(int)
-    data_ad['Mes'] = data_ad["Mes"].astype(int)
-    data_ad['Dia'] = 1
-    data_ad['Fecha'] = pd.to_datetime(data_ad['Año'].astype(str) + '-' + data_ad['Mes'].astype(str) + '-' + data_ad['Dia'].astype(str))
-    data_ad = data_ad[(data_ad['Uen'].isin(uen)) & (data_ad['Canal Comercial'].isin(canal2)) & (data_ad['Regional'].isin(regional)) & 
-                      (data_ad['Marquilla'].isin(marquilla)) & (data_ad['Producto'].isin(producto))]
-    serie_ventas = data_ad.groupby('Fecha')['Ventas'].sum().reset_index()
+def plot_time_series_1(cubo, uen, canal2, regional, marquilla, producto):
+    mascara = mascara_cubo(cubo, {"Uen": uen, "Canal Comercial": canal2, "Regional": regional,
+                                  "Marquilla": marquilla, "Producto": producto})
+    fechas, ventas = reducir_serie(*serie_por_fecha(cubo, mascara, "Ventas"))
 
     fig = go.Figure(
         data=[
             go.Scatter(
-                x=serie_ventas['Fecha'],
-                y=serie_ventas['Ventas'],
+                x=fechas,
+                y=ventas,
                 mode = 'lines+markers',
                 line=dict(color="#3498db"),
                 name="Ventas por Fecha"
@@ -532,20 +996,20 @@ def plot_time_series_1(data_ad, uen, canal2, regional, marquilla, producto):
     return fig
 
 
-def plot_time_series_2(data_ad, uen, canal2, regional, marquilla, producto):
-    data_ad['Año'] = data_ad["Año"].astype(int)
-    data_ad['Mes'] = data_ad["Mes"].astype(int)
-    data_ad['Dia'] = 1
-    data_ad['Fecha'] = pd.to_datetime(data_ad['Año'].astype(str) + '-' + data_ad['Mes'].astype(str) + '-' + data_ad['Dia'].astype(str))
-    data_ad = data_ad[(data_ad['Uen'].isin(uen)) & (data_ad['Canal Comercial'].isin(canal2)) & (data_ad['Regional'].isin(regional)) & 
-                      (data_ad['Marquilla'].isin(marquilla)) & (data_ad['Producto'].isin(producto))]
-    serie_margen = data_ad.groupby('Fecha')['Margen'].mean().reset_index()
+def plot_time_series_2(cubo, uen, canal2, regional, marquilla, producto):
+    mascara = mascara_cubo(cubo, {"Uen": uen, "Canal Comercial": canal2, "Regional": regional,
+                                  "Marquilla": marquilla, "Producto": producto})
+    # Margen promedio por fecha = suma del margen / filas con margen
+    fechas, suma_margen = serie_por_fecha(cubo, mascara, "Margen")
+    _, filas_margen = serie_por_fecha(cubo, mascara, "Filas Margen")
+    margen_promedio = np.divide(suma_margen, filas_margen, out=np.full(len(suma_margen), np.nan), where=filas_margen > 0)
+    fechas, margen_promedio = reducir_serie(fechas, margen_promedio)
 
     fig = go.Figure(
         data=[
             go.Scatter(
-                x=serie_margen['Fecha'],
-                y=serie_margen['Margen']*100,
+                x=fechas,
+                y=margen_promedio*100,
                 mode = 'lines+markers',
                 line=dict(color="#3498db"),
                 name="Margen por Fecha"
@@ -568,17 +1032,18 @@ def plot_time_series_2(data_ad, uen, canal2, regional, marquilla, producto):
 
     return fig
 
-def plot_time_series_predict(data_ad, datos_prediccion, uen_p, regional_p, canal, marq_p, codigo_p, producto_p):
-    data_ad['Año'] = data_ad["Año"].astype(int)
-    data_ad['Mes'] = data_ad["Mes"].astype(int)
-    data_ad['Dia'] = 1
-    data_ad['Fecha'] = pd.to_datetime(data_ad['Año'].astype(str) + '-' + data_ad['Mes'].astype(str) + '-' + data_ad['Dia'].astype(str))
-    data_ad = data_ad[(data_ad['Uen'] == uen_p) & (data_ad['Canal Comercial'] == canal) & (data_ad['Regional'] == regional_p) & 
-                      (data_ad['Marquilla'] == marq_p) & (data_ad['Producto'] == producto_p) & (data_ad['Código Producto'] == codigo_p)]
-    serie_ventas = data_ad.groupby('Fecha')['Ventas'].sum().reset_index()
+# Función para obtener las ventas por fecha de una combinación (vacía si la combinación no existe)
+def historia_combinacion(uen_p, regional_p, canal, marq_p, codigo_p, producto_p):
+    mascara = mascara_cubo(cubo_ventas, {"Uen": [uen_p], "Canal Comercial": [canal], "Regional": [regional_p],
+                                         "Marquilla": [marq_p], "Producto": [producto_p], "Código Producto": [codigo_p]})
+    fechas, ventas = serie_por_fecha(cubo_ventas, mascara, "Ventas")
+    return pd.DataFrame({'Fecha': fechas, 'Ventas': ventas})
+
+
+def plot_time_series_predict(serie_ventas, datos_prediccion):
 
     # Manejar el caso de datos vacíos
-    if data_ad.empty:
+    if serie_ventas.empty:
         fig = go.Figure()
         fig.update_layout(
             title="No hay datos para la combinación de campos ingresada!",
@@ -588,11 +1053,13 @@ def plot_time_series_predict(data_ad, datos_prediccion, uen_p, regional_p, canal
         )
         return fig
 
+    fechas_historia, ventas_historia = reducir_serie(serie_ventas['Fecha'].to_numpy(), serie_ventas['Ventas'].to_numpy())
+
     fig = go.Figure(
         data=[
             go.Scatter(
-                x=serie_ventas['Fecha'],
-                y=serie_ventas['Ventas'],
+                x=fechas_historia,
+                y=ventas_historia,
                 mode = 'lines+markers',
                 line=dict(color="#3498db"),
                 name="Ventas por Fecha"
@@ -602,10 +1069,7 @@ def plot_time_series_predict(data_ad, datos_prediccion, uen_p, regional_p, canal
 
     # Agregar predicción si está disponible
     if not datos_prediccion.empty:
-        datos_prediccion['Año'] = datos_prediccion["Año"].astype(int)
-        datos_prediccion['Mes'] = datos_prediccion["Mes"].astype(int)
-        datos_prediccion['Dia'] = 1
-        datos_prediccion['Fecha'] = pd.to_datetime(datos_prediccion['Año'].astype(str) + '-' + datos_prediccion['Mes'].astype(str) + '-' + datos_prediccion['Dia'].astype(str))
+        datos_prediccion = datos_prediccion.assign(Fecha=construir_fechas(datos_prediccion["Año"], datos_prediccion["Mes"]))
         ultimo_hist = serie_ventas.iloc[-1]
 
         datos_prediccion = pd.concat([
@@ -714,7 +1178,7 @@ app.layout = html.Div(
                             children=[
                                 html.Div(
                                     id="kpi-container",
-                                    children = generate_KPI(data_ad)
+                                    children = generate_KPI(totales_cubo(cubo_ventas, np.ones(len(cubo_ventas["filas"]), dtype=bool)))
                                 ),                            
                                 html.Hr(),
 
@@ -782,7 +1246,7 @@ app.layout = html.Div(
                             children=[
                                 #html.B("Ventas por Canal Comercial"),
                                 html.Hr(),
-                                dcc.Graph(id="plot_series_1"),
+                                dcc.Graph(id="plot_series_1", figure=plot_bar_1(cubo_ventas)),
                             ],
                         ),
                         # Second graph on the right
@@ -791,7 +1255,7 @@ app.layout = html.Div(
                             children=[
                                 #html.B("Ventas por Marquilla"),
                                 html.Hr(),
-                                dcc.Graph(id="plot_series_2"),
+                                dcc.Graph(id="plot_series_2", figure=plot_bar_2(cubo_ventas)),
                             ],
                         ),
                     ],
@@ -807,7 +1271,7 @@ app.layout = html.Div(
                             children=[
                                 #html.B("Distribución de Ventas por Unidad de Negocio UEN"),
                                 html.Hr(),
-                                dcc.Graph(id="plot_series_3"),
+                                dcc.Graph(id="plot_series_3", figure=plot_pie_chart(cubo_ventas)),
                             ],
                         ),
                     ],
@@ -866,73 +1330,204 @@ app.layout = html.Div(
 
 
 
+# Los gráficos de barras y de torta no dependen de ningún filtro: se calculan una vez en el layout.
+# Cada callback depende solo de sus filtros y memoriza sus resultados por la tupla de valores de entrada.
+# Las listas de los dropdowns múltiples se convierten a tuplas ordenadas y sin repetidos, así la misma
+# selección en otro orden usa la misma entrada del cache.
+def a_tupla(valor):
+    return tuple(sorted(set(valor), key=str)) if isinstance(valor, list) else valor
+
+
+# Las figuras se guardan en el cache como diccionarios: serializar un diccionario es mucho más rápido
+# que serializar un go.Figure en cada respuesta
+def figura_a_dict(fig):
+    return fig.to_dict()
+
+
+@lru_cache(maxsize=tamano_cache_callbacks)
+def calcular_kpis(anio, mes, uen, canal2, regional, marquilla, producto):
+    return generate_KPI(motor_kpi.totales({"Año": anio, "Mes": mes, "Uen": uen, "Regional": regional,
+                                           "Canal Comercial": canal2, "Marquilla": marquilla, "Producto": producto}))
+
+
+@lru_cache(maxsize=tamano_cache_callbacks)
+def calcular_series(uen, canal2, regional, marquilla, producto):
+    fig5 = plot_time_series_1(cubo_ventas, uen, canal2, regional, marquilla, producto)
+    fig6 = plot_time_series_2(cubo_ventas, uen, canal2, regional, marquilla, producto)
+    return figura_a_dict(fig5), figura_a_dict(fig6)
+
+
+# Sesión HTTP hacia la API de predicción: reutiliza conexiones (keep-alive) y reintenta con backoff exponencial
+# los errores de conexión y las respuestas 502/503/504. La predicción no modifica estado, así que reintentar el POST es seguro.
+def crear_sesion_api():
+    reintentos = Retry(total=3, connect=3, read=2, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                       allowed_methods=frozenset(["POST"]), raise_on_status=False)
+    adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=reintentos)
+
+    sesion = requests.Session()
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    sesion.headers.update({"Content-Type":"application/json", "accept": "application/json"})
+    return sesion
+
+
+# Una sesión por proceso: los procesos de los callbacks en segundo plano no deben compartir los sockets del padre
+sesion_api = None
+pid_sesion_api = None
+
+
+def obtener_sesion_api():
+    global sesion_api, pid_sesion_api
+    if sesion_api is None or pid_sesion_api != os.getpid():
+        sesion_api = crear_sesion_api()
+        pid_sesion_api = os.getpid()
+    return sesion_api
+
+
+# Consulta a la API de predicción. Si la respuesta no es exitosa se lanza HTTPError, así el error no queda memorizado
+def consultar_prediccion(uen_p, regional_p, canal, marq_p, codigo_p, producto_p, meses_p):
+    myreq = {
+        
+            "meses_a_proyectar": int(meses_p),
+            "Uen": str(uen_p),
+            "Regional": str(regional_p),
+            "Canal_Comercial": str(canal),
+            "Marquilla": str(marq_p),
+            "Codigo_Producto": str(codigo_p),
+            "Producto": str(producto_p)
+    }
+
+    # POST call to the API
+    response = obtener_sesion_api().post(api_url, data=json.dumps(myreq), timeout=timeout_api)
+
+    if response.status_code != 200:
+        raise requests.HTTPError("La API de predicción respondió con estado {}".format(response.status_code), response=response)
+
+    data = response.json()
+    logger.info("Response: {}".format(data))
+
+    datos_prediccion = pd.DataFrame(data['result'])
+    datos_prediccion.iloc[0,1] = datos_prediccion.iloc[0,1] - 1
+    return datos_prediccion
+
+
+# En segundo plano cada trabajo corre en su propio proceso y el cache en memoria no se comparte entre trabajos,
+# por eso las predicciones exitosas también se memorizan en el cache en disco
+if cache_tablero is not None:
+    consultar_prediccion = cache_tablero.memoize(name="consultar_prediccion", expire=expiracion_cache_predicciones)(consultar_prediccion)
+
+
+# Cache en memoria como lru_cache, pero cada resultado expira a los `segundos` de calcularse (los errores no se guardan)
+def lru_cache_expiracion(maxsize, segundos):
+    def decorador(funcion):
+        entradas = OrderedDict()  # argumentos -> (resultado, momento en que se calculó)
+        lock = threading.Lock()
+
+        @wraps(funcion)
+        def envoltura(*args):
+            with lock:
+                entrada = entradas.get(args)
+                if entrada is not None and time.monotonic() - entrada[1] < segundos:
+                    entradas.move_to_end(args)
+                    return entrada[0]
+
+            inicio = time.monotonic()
+            resultado = funcion(*args)
+            with lock:
+                entradas[args] = (resultado, inicio)
+                entradas.move_to_end(args)
+                while len(entradas) > maxsize:
+                    entradas.popitem(last=False)
+            return resultado
+
+        return envoltura
+    return decorador
+
+
+@lru_cache_expiracion(maxsize=tamano_cache_callbacks, segundos=expiracion_cache_predicciones)
+def calcular_pronostico(canal, uen_p, regional_p, marq_p, codigo_p, producto_p, meses_p):
+    datos_prediccion = pd.DataFrame()
+
+    # Las combinaciones que no existen en los datos no se envían a la API
+    if ((meses_p is not None) & (uen_p is not None) & (regional_p is not None) &
+        (canal is not None) & (marq_p is not None) & (codigo_p is not None) & (producto_p is not None) &
+        combinacion_existe(uen_p, regional_p, canal, marq_p, codigo_p, producto_p)):
+        datos_prediccion = consultar_prediccion(uen_p, regional_p, canal, marq_p, codigo_p, producto_p, meses_p)
+
+    return figura_a_dict(plot_time_series_predict(historia_combinacion(uen_p, regional_p, canal, marq_p, codigo_p, producto_p), datos_prediccion))
+
+
+# Dropdowns en cascada de la predicción: cada nivel (menos Uen) actualiza sus opciones con los valores de los
+# niveles anteriores, y conserva su valor si sigue siendo válido o toma la primera opción
+def update_opciones_nivel(*valores):
+    *valores_padres, valor_actual = valores
+    opciones = opciones_jerarquia(*valores_padres)
+    valor = valor_actual if valor_actual in opciones else (opciones[0] if opciones else None)
+    return [{'label': opcion, 'value': opcion} for opcion in opciones], valor
+
+
+for nivel in range(1, len(ids_jerarquia)):
+    app.callback(
+        [Output(component_id=ids_jerarquia[nivel], component_property="options"),
+         Output(component_id=ids_jerarquia[nivel], component_property="value")],
+        [Input(component_id=id_padre, component_property="value") for id_padre in ids_jerarquia[:nivel]],
+        State(component_id=ids_jerarquia[nivel], component_property="value")
+    )(update_opciones_nivel)
+
+
 @app.callback(
-    [Output(component_id="plot_series_1", component_property="figure"),
-     Output(component_id="plot_series_2", component_property="figure"),
-     Output(component_id="plot_series_3", component_property="figure"),
-     Output(component_id="plot_series_5", component_property="figure"),
-     Output(component_id="plot_time_series_1", component_property="figure"),
-     Output(component_id="plot_time_series_2", component_property="figure"),
-     Output("kpi-container", "children")],
-    [#Input("interval", "n_intervals"),
-     Input(component_id="canal-prediccion", component_property="value"),
-     Input(component_id="anio-dropdown", component_property="value"),
+    Output("kpi-container", "children"),
+    [Input(component_id="anio-dropdown", component_property="value"),
      Input(component_id="mes-dropdown", component_property="value"),
      Input(component_id="uen-dropdown", component_property="value"),
      Input(component_id="canal2-dropdown", component_property="value"),
      Input(component_id="regional-dropdown", component_property="value"),
      Input(component_id="marquilla-dropdown", component_property="value"),
-     Input(component_id="producto-dropdown", component_property="value"),
-     Input(component_id="uen-prediccion", component_property="value"),
-     Input(component_id="regional-prediccion", component_property="value"),
-     Input(component_id="marquilla-prediccion", component_property="value"),
-     Input(component_id="codigo-prediccion", component_property="value"),
-     Input(component_id="producto-prediccion", component_property="value"),
-     Input(component_id="meses-prediccion", component_property="value")
+     Input(component_id="producto-dropdown", component_property="value")
      ]
 )
-def update_output_div(canal, anio, mes, uen, canal2, regional, marquilla, producto, uen_p, regional_p, marq_p, codigo_p, producto_p, meses_p):
-
-    print(uen)
-    fig1 = plot_bar_1(data_ad)   
-    fig2 = plot_bar_2(data_ad)  
-    fig3 = plot_pie_chart(data_ad)
-    fig5 = plot_time_series_1(data_ad, uen, canal2, regional, marquilla, producto)
-    fig6 = plot_time_series_2(data_ad, uen, canal2, regional, marquilla, producto)
-
-    filtered_data = data_ad[(data_ad['Uen'].isin(uen)) & (data_ad['Canal Comercial'].isin(canal2)) & (data_ad['Regional'].isin(regional)) & 
-                      (data_ad['Marquilla'].isin(marquilla)) & (data_ad['Producto'].isin(producto)) & (data_ad['Año'].isin(anio)) & 
-                      (data_ad['Mes'].isin(mes))]
-    
-    datos_prediccion = pd.DataFrame()
+def update_kpis(anio, mes, uen, canal2, regional, marquilla, producto):
+    return calcular_kpis(a_tupla(anio), a_tupla(mes), a_tupla(uen), a_tupla(canal2), a_tupla(regional),
+                         a_tupla(marquilla), a_tupla(producto))
 
-    if ((meses_p is not None) & (uen_p is not None) & (regional_p is not None) &
-        (canal is not None) & (marq_p is not None) & (codigo_p is not None) & (producto_p is not None)):
-        myreq = {
-            
-                "meses_a_proyectar": int(meses_p),
-                "Uen": str(uen_p),
-                "Regional": str(regional_p),
-                "Canal_Comercial": str(canal),
-                "Marquilla": str(marq_p),
-                "Codigo_Producto": str(codigo_p),
-                "Producto": str(producto_p)
-        }
-        headers =  {"Content-Type":"application/json", "accept": "application/json"}
-
-        # POST call to the API
-        response = requests.post(api_url, data=json.dumps(myreq), headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            logger.info("Response: {}".format(data))
-
-            datos_prediccion = pd.DataFrame(data['result'])
-            datos_prediccion.iloc[0,1] = datos_prediccion.iloc[0,1] - 1
-
-    fig4 = plot_time_series_predict(data_ad, datos_prediccion, uen_p, regional_p, canal, marq_p, codigo_p, producto_p)
-
-    return fig1, fig2, fig3, fig4, fig5, fig6, generate_KPI(filtered_data)
+
+@app.callback(
+    [Output(component_id="plot_time_series_1", component_property="figure"),
+     Output(component_id="plot_time_series_2", component_property="figure")],
+    [Input(component_id="uen-dropdown", component_property="value"),
+     Input(component_id="canal2-dropdown", component_property="value"),
+     Input(component_id="regional-dropdown", component_property="value"),
+     Input(component_id="marquilla-dropdown", component_property="value"),
+     Input(component_id="producto-dropdown", component_property="value")
+     ]
+)
+def update_time_series(uen, canal2, regional, marquilla, producto):
+    return calcular_series(a_tupla(uen), a_tupla(canal2), a_tupla(regional), a_tupla(marquilla), a_tupla(producto))
+
+
+# Entradas del pronóstico: cualquier cambio en ellas también cancela el trabajo en segundo plano que esté corriendo
+entradas_pronostico = [Input(component_id="canal-prediccion", component_property="value"),
+                       Input(component_id="uen-prediccion", component_property="value"),
+                       Input(component_id="regional-prediccion", component_property="value"),
+                       Input(component_id="marquilla-prediccion", component_property="value"),
+                       Input(component_id="codigo-prediccion", component_property="value"),
+                       Input(component_id="producto-prediccion", component_property="value"),
+                       Input(component_id="meses-prediccion", component_property="value")]
+
+
+@app.callback(
+    Output(component_id="plot_series_5", component_property="figure"),
+    entradas_pronostico,
+    background=background_callback_manager is not None,
+    manager=background_callback_manager,
+    cancel=entradas_pronostico if background_callback_manager is not None else None
+)
+def update_forecast(canal, uen_p, regional_p, marq_p, codigo_p, producto_p, meses_p):
+    try:
+        return calcular_pronostico(canal, uen_p, regional_p, marq_p, codigo_p, producto_p, meses_p)
+    except requests.RequestException as error:
+        logger.warning("No se pudo obtener la predicción: {}".format(error))
+        return plot_time_series_predict(historia_combinacion(uen_p, regional_p, canal, marq_p, codigo_p, producto_p), pd.DataFrame())
 
 
 # Run the server
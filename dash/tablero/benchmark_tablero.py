@@ -0,0 +1,366 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import psutil
+import requests
+from loguru import logger
+
+
+# Benchmark de carga del tablero: simula usuarios que cambian filtros y selecciones de la predicción, enviando las
+# mismas llamadas a /_dash-update-component que haría el navegador (incluidos los dropdowns en cascada y el sondeo
+# de los callbacks en segundo plano). La API de predicción se reemplaza por un stub local en el puerto 8001.
+# Reporta la latencia p50/p95/p99 por callback, el throughput y la memoria de cada worker de gunicorn.
+#
+# Uso desde la carpeta donde están los datos del tablero:
+#   python benchmark_tablero.py --workers 2 --usuarios 8 --acciones 50 --salida resultados.json
+#   python benchmark_tablero.py --workers 2 --usuarios 8 --base resultados.json   (compara contra una línea base)
+
+directorio_tablero = os.path.dirname(os.path.abspath(__file__))
+puerto_api = 8001  # El tablero siempre llama a http://{API_URL}:8001/predict
+timeout_sondeo = 120  # Segundos máximos de sondeo de un callback en segundo plano
+
+
+# Stub de la API de predicción: responde como /predict/ con la cantidad de meses pedida, después de una latencia fija
+def crear_stub_api(latencia):
+    class ManejadorPrediccion(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            solicitud = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(latencia)
+            meses = int(solicitud["meses_a_proyectar"])
+            resultado = [{"Año": 2024 + (i + 1) // 12, "Mes": (i + 1) % 12 + 1, "Ventas": 1000000.0 + 1000.0 * i} for i in range(meses)]
+            cuerpo = json.dumps({"result": resultado}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto_api), ManejadorPrediccion)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+# Iniciar el tablero con gunicorn (con varios workers usa el cubo compartido en memoria).
+# La salida de gunicorn y del tablero queda en ruta_log para revisar los errores de los callbacks
+def iniciar_tablero(workers, hilos, puerto, ruta_log):
+    entorno = dict(os.environ, API_URL="127.0.0.1", DASH_MEMORIA_COMPARTIDA="1" if workers > 1 else "0")
+    comando = ["gunicorn", "app_tablero:server", "--pythonpath", directorio_tablero, "--chdir", os.getcwd(),
+               "--workers", str(workers), "--threads", str(hilos), "--preload", "--bind", "127.0.0.1:{}".format(puerto)]
+    with open(ruta_log, "w") as log:
+        return subprocess.Popen(comando, env=entorno, stdout=log, stderr=subprocess.STDOUT)
+
+
+def esperar_tablero(url, proceso, tiempo_maximo=300):
+    inicio = time.time()
+    while time.time() - inicio < tiempo_maximo:
+        if proceso is not None and proceso.poll() is not None:
+            raise RuntimeError("El tablero terminó antes de quedar listo (código {})".format(proceso.returncode))
+        try:
+            if requests.get(url + "/_dash-layout", timeout=5).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError("El tablero no respondió en {} segundos".format(tiempo_maximo))
+
+
+# Muestreo periódico de la memoria de los workers (se guarda el máximo de cada proceso)
+class MonitorMemoria:
+    def __init__(self, pid_principal, intervalo=0.5):
+        self.pid_principal = pid_principal
+        self.intervalo = intervalo
+        self.maximos = {}
+        self.detener = threading.Event()
+        self.hilo = threading.Thread(target=self.muestrear, daemon=True)
+
+    # Proceso principal de gunicorn y sus workers (los trabajos en segundo plano duran poco y no se incluyen)
+    def procesos(self):
+        principal = psutil.Process(self.pid_principal)
+        return [principal] + principal.children()
+
+    def muestrear(self):
+        while not self.detener.is_set():
+            try:
+                for proceso in self.procesos():
+                    info = proceso.memory_full_info()
+                    maximo = self.maximos.setdefault(proceso.pid, {"ppid": proceso.ppid(), "rss": 0, "uss": 0, "pss": 0})
+                    for campo in ("rss", "uss", "pss"):
+                        maximo[campo] = max(maximo[campo], getattr(info, campo, 0))
+            except psutil.Error:
+                pass
+            self.detener.wait(self.intervalo)
+
+    def iniciar(self):
+        self.hilo.start()
+
+    def finalizar(self):
+        self.detener.set()
+        self.hilo.join()
+        return [dict(pid=pid, **valores) for pid, valores in sorted(self.maximos.items())]
+
+
+# Buscar en el layout las propiedades de los componentes con id (valores y opciones iniciales de los dropdowns)
+def componentes_layout(nodo, componentes):
+    if isinstance(nodo, dict):
+        propiedades = nodo.get("props", {})
+        if "id" in propiedades:
+            componentes[propiedades["id"]] = propiedades
+        for valor in propiedades.values():
+            componentes_layout(valor, componentes)
+    elif isinstance(nodo, list):
+        for elemento in nodo:
+            componentes_layout(elemento, componentes)
+    return componentes
+
+
+# Valores de las opciones de un dropdown (diccionarios label/value o valores sueltos)
+def valores_opciones(opciones):
+    return [opcion["value"] if isinstance(opcion, dict) else opcion for opcion in opciones or []]
+
+
+# Salidas de un callback a partir del texto de su output ("a.b" o "..a.b...c.d..")
+def salidas_callback(output):
+    multiple = output.startswith("..")
+    textos = output.strip(".").split("...") if multiple else [output]
+    salidas = [dict(zip(("id", "property"), texto.rsplit(".", 1))) for texto in textos]
+    return salidas, multiple
+
+
+# Usuario virtual: guarda el estado de los componentes y ejecuta los callbacks como el renderer de Dash
+class UsuarioVirtual:
+    def __init__(self, url, dependencias, rnd, intervalo_sondeo, latencias, lock):
+        self.url = url
+        self.dependencias = dependencias
+        self.rnd = rnd
+        self.intervalo_sondeo = intervalo_sondeo
+        self.latencias = latencias
+        self.lock = lock
+        self.sesion = requests.Session()
+        self.estado = {}
+
+    def registrar(self, nombre, segundos):
+        with self.lock:
+            self.latencias.setdefault(nombre, []).append(segundos)
+
+    def cargar_pagina(self):
+        inicio = time.perf_counter()
+        layout = self.sesion.get(self.url + "/_dash-layout").json()
+        self.registrar("layout", time.perf_counter() - inicio)
+        for id_componente, propiedades in componentes_layout(layout, {}).items():
+            for propiedad in ("value", "options"):
+                if propiedad in propiedades:
+                    self.estado[(id_componente, propiedad)] = propiedades[propiedad]
+        # Carga inicial: el renderer ejecuta todos los callbacks
+        self.propagar(set(), todos=True)
+
+    def ejecutar_callback(self, dependencia):
+        salidas, multiple = salidas_callback(dependencia["output"])
+        carga = {
+            "output": dependencia["output"],
+            "outputs": salidas if multiple else salidas[0],
+            "inputs": [dict(entrada, value=self.estado.get((entrada["id"], entrada["property"]))) for entrada in dependencia["inputs"]],
+            "state": [dict(estado, value=self.estado.get((estado["id"], estado["property"]))) for estado in dependencia["state"]],
+            "changedPropIds": ["{}.{}".format(entrada["id"], entrada["property"]) for entrada in dependencia["inputs"]],
+        }
+
+        inicio = time.perf_counter()
+        respuesta = self.sesion.post(self.url + "/_dash-update-component", json=carga)
+        respuesta.raise_for_status()
+        contenido = respuesta.json() if respuesta.content else {}
+
+        # Callback en segundo plano: se sondea el resultado del trabajo hasta que esté listo.
+        # Si el trabajo terminó sin resultado (por ejemplo, otro usuario con los mismos filtros ya leyó
+        # la misma llave de caché) Dash responde 204, y el renderer deja de sondear igual que aquí
+        if "cacheKey" in contenido:
+            parametros = {"cacheKey": contenido["cacheKey"], "job": contenido["job"]}
+            limite = time.perf_counter() + timeout_sondeo
+            while "response" not in contenido:
+                if time.perf_counter() > limite:
+                    raise TimeoutError("El callback {} no respondió en {} segundos".format(dependencia["output"], timeout_sondeo))
+                time.sleep(self.intervalo_sondeo)
+                respuesta = self.sesion.post(self.url + "/_dash-update-component", json=carga, params=parametros)
+                respuesta.raise_for_status()
+                if respuesta.status_code == 204:
+                    break
+                contenido = respuesta.json() if respuesta.content else {}
+        self.registrar(dependencia["output"].strip("."), time.perf_counter() - inicio)
+
+        cambiados = set()
+        for id_componente, propiedades in contenido.get("response", {}).items():
+            for propiedad, valor in propiedades.items():
+                self.estado[(id_componente, propiedad)] = valor
+                cambiados.add((id_componente, propiedad))
+        return cambiados
+
+    # Ejecutar los callbacks afectados por los cambios, en orden: un callback espera a los que producen sus entradas
+    def propagar(self, cambiados, todos=False):
+        pendientes = [dependencia for dependencia in self.dependencias
+                      if todos or any((entrada["id"], entrada["property"]) in cambiados for entrada in dependencia["inputs"])]
+        while pendientes:
+            salidas_pendientes = {(salida["id"], salida["property"]) for dependencia in pendientes for salida in salidas_callback(dependencia["output"])[0]}
+            listos = [dependencia for dependencia in pendientes
+                      if not any((entrada["id"], entrada["property"]) in salidas_pendientes for entrada in dependencia["inputs"])]
+            dependencia = listos[0] if listos else pendientes[0]
+            pendientes.remove(dependencia)
+            nuevos = self.ejecutar_callback(dependencia)
+            for otra in self.dependencias:
+                if otra not in pendientes and any((entrada["id"], entrada["property"]) in nuevos for entrada in otra["inputs"]):
+                    pendientes.append(otra)
+
+    # Acción aleatoria de un usuario: cambiar un filtro del análisis descriptivo o la selección de la predicción
+    def accion(self):
+        filtros = ["anio-dropdown", "mes-dropdown", "uen-dropdown", "canal2-dropdown", "regional-dropdown", "marquilla-dropdown", "producto-dropdown"]
+        prediccion = ["uen-prediccion", "regional-prediccion", "canal-prediccion", "marquilla-prediccion", "codigo-prediccion", "producto-prediccion"]
+        sorteo = self.rnd.random()
+
+        if sorteo < 0.55:
+            # Agregar o quitar un valor de un filtro múltiple, o seleccionar todas sus opciones
+            id_filtro = self.rnd.choice(filtros)
+            opciones = valores_opciones(self.estado.get((id_filtro, "options")))
+            seleccion = list(self.estado.get((id_filtro, "value")) or [])
+            if self.rnd.random() < 0.15:
+                seleccion = list(opciones)
+            elif len(seleccion) > 1 and self.rnd.random() < 0.4:
+                seleccion.remove(self.rnd.choice(seleccion))
+            else:
+                faltantes = [opcion for opcion in opciones if opcion not in seleccion]
+                if faltantes:
+                    seleccion.append(self.rnd.choice(faltantes))
+            self.estado[(id_filtro, "value")] = seleccion
+            self.propagar({(id_filtro, "value")})
+        elif sorteo < 0.85:
+            # Cambiar un nivel de la selección de la predicción (dispara los dropdowns en cascada y el pronóstico)
+            id_nivel = self.rnd.choice(prediccion)
+            opciones = valores_opciones(self.estado.get((id_nivel, "options")))
+            if opciones:
+                self.estado[(id_nivel, "value")] = self.rnd.choice(opciones)
+                self.propagar({(id_nivel, "value")})
+        else:
+            self.estado[("meses-prediccion", "value")] = self.rnd.randint(1, 24)
+            self.propagar({("meses-prediccion", "value")})
+
+
+def ejecutar_usuario(url, dependencias, semilla, acciones, pausa, intervalo_sondeo, latencias, lock, errores):
+    usuario = UsuarioVirtual(url, dependencias, random.Random(semilla), intervalo_sondeo, latencias, lock)
+    try:
+        usuario.cargar_pagina()
+        for _ in range(acciones):
+            usuario.accion()
+            if pausa:
+                time.sleep(pausa)
+    except (requests.RequestException, TimeoutError) as error:
+        with lock:
+            errores.append(str(error))
+
+
+# Percentiles de latencia (milisegundos) de una lista de tiempos en segundos
+def resumir(tiempos):
+    milisegundos = np.asarray(tiempos) * 1000
+    return {"n": len(milisegundos), "p50": float(np.percentile(milisegundos, 50)), "p95": float(np.percentile(milisegundos, 95)),
+            "p99": float(np.percentile(milisegundos, 99)), "media": float(milisegundos.mean())}
+
+
+def imprimir_reporte(resultados, base=None):
+    print("\n{:<62} {:>6} {:>9} {:>9} {:>9}".format("callback", "n", "p50 ms", "p95 ms", "p99 ms"))
+    for nombre, resumen in list(resultados["callbacks"].items()) + [("TOTAL", resultados["total"])]:
+        linea = "{:<62} {:>6} {:>9.1f} {:>9.1f} {:>9.1f}".format(nombre[:62], resumen["n"], resumen["p50"], resumen["p95"], resumen["p99"])
+        referencia = base["total"] if base and nombre == "TOTAL" else (base or {}).get("callbacks", {}).get(nombre)
+        if referencia:
+            linea += "   base p50 {:>8.1f} ({:+.0f}%)  p95 {:>8.1f} ({:+.0f}%)".format(
+                referencia["p50"], 100 * (resumen["p50"] / referencia["p50"] - 1),
+                referencia["p95"], 100 * (resumen["p95"] / referencia["p95"] - 1))
+        print(linea)
+
+    print("\nThroughput: {:.1f} callbacks/s en {:.1f} s ({} errores)".format(resultados["throughput"], resultados["duracion"], len(resultados["errores"])))
+    if base:
+        print("Throughput base: {:.1f} callbacks/s".format(base["throughput"]))
+    for proceso in resultados["memoria"]:
+        print("Proceso {pid} (padre {ppid}): RSS {rss_mb:.0f} MB, USS {uss_mb:.0f} MB, PSS {pss_mb:.0f} MB".format(
+            rss_mb=proceso["rss"] / 2**20, uss_mb=proceso["uss"] / 2**20, pss_mb=proceso["pss"] / 2**20, **proceso))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de carga y latencia de los callbacks del tablero")
+    parser.add_argument("--url", default=None, help="URL de un tablero ya iniciado; si no se da, se inicia con gunicorn")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de gunicorn al iniciar el tablero")
+    parser.add_argument("--hilos", type=int, default=1,
+                        help="Hilos por worker de gunicorn (run.sh usa 1; con más hilos DiskcacheManager puede hacer fork "
+                             "mientras otro hilo tiene abierta una transacción de SQLite y el trabajo queda bloqueado)")
+    parser.add_argument("--puerto", type=int, default=8060, help="Puerto del tablero iniciado por el benchmark")
+    parser.add_argument("--usuarios", type=int, default=4, help="Usuarios concurrentes")
+    parser.add_argument("--acciones", type=int, default=30, help="Acciones (cambios de filtros) por usuario")
+    parser.add_argument("--pausa", type=float, default=0.0, help="Segundos de espera entre acciones de un usuario")
+    parser.add_argument("--latencia-api", type=float, default=0.05, help="Latencia (s) del stub de la API de predicción")
+    parser.add_argument("--intervalo-sondeo", type=float, default=0.05, help="Segundos entre sondeos de los callbacks en segundo plano")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--log", default="benchmark_tablero.log", help="Archivo con la salida del tablero iniciado por el benchmark")
+    parser.add_argument("--salida", default=None, help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--base", default=None, help="Archivo JSON de resultados anteriores para comparar")
+    args = parser.parse_args()
+
+    stub_api = crear_stub_api(args.latencia_api)
+    proceso = None
+    url = args.url
+    if url is None:
+        url = "http://127.0.0.1:{}".format(args.puerto)
+        proceso = iniciar_tablero(args.workers, args.hilos, args.puerto, args.log)
+
+    try:
+        esperar_tablero(url, proceso)
+        monitor = MonitorMemoria(proceso.pid) if proceso is not None else None
+        if monitor is not None:
+            monitor.iniciar()
+
+        dependencias = requests.get(url + "/_dash-dependencies").json()
+        latencias, errores, lock = {}, [], threading.Lock()
+        logger.info("Iniciando {} usuarios con {} acciones cada uno contra {}".format(args.usuarios, args.acciones, url))
+
+        inicio = time.time()
+        with ThreadPoolExecutor(max_workers=args.usuarios) as executor:
+            for i in range(args.usuarios):
+                executor.submit(ejecutar_usuario, url, dependencias, args.semilla + i, args.acciones, args.pausa,
+                                args.intervalo_sondeo, latencias, lock, errores)
+        duracion = time.time() - inicio
+
+        memoria = monitor.finalizar() if monitor is not None else []
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+        stub_api.shutdown()
+
+    callbacks = {nombre: resumir(tiempos) for nombre, tiempos in sorted(latencias.items()) if nombre != "layout"}
+    todos = [tiempo for nombre, tiempos in latencias.items() if nombre != "layout" for tiempo in tiempos]
+    resultados = {
+        "configuracion": vars(args),
+        "callbacks": dict(callbacks, layout=resumir(latencias["layout"])) if "layout" in latencias else callbacks,
+        "total": resumir(todos),
+        "throughput": len(todos) / duracion,
+        "duracion": duracion,
+        "memoria": memoria,
+        "errores": errores,
+    }
+
+    base = None
+    if args.base:
+        with open(args.base, encoding="utf-8") as archivo:
+            base = json.load(archivo)
+    imprimir_reporte(resultados, base)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+        logger.info("Resultados guardados en {}".format(args.salida))
@@ -0,0 +1,26 @@
+import os
+import pandas as pd
+from loguru import logger
+
+
+# Convierte el CSV de la capa gold que usa el tablero a Parquet. Las columnas de texto se guardan como
+# categóricas (codificación por diccionario), así el tablero carga menos bytes y ocupa menos memoria.
+# Se ejecuta desde la carpeta dash/tablero: python convertir_datos.py
+ruta_csv = "ExporteCOL2022_2023_2024_top_products.csv"
+ruta_parquet = "ExporteCOL2022_2023_2024_top_products.parquet"
+
+
+def convertir_a_parquet(ruta_csv, ruta_parquet):
+    data = pd.read_csv(ruta_csv, sep=',')
+    for columna in data.select_dtypes(include="object").columns:
+        data[columna] = data[columna].astype("category")
+
+    # Se escribe a un archivo temporal y se reemplaza, para no dejar un Parquet incompleto si el proceso falla
+    ruta_temporal = ruta_parquet + ".tmp"
+    data.to_parquet(ruta_temporal, engine="pyarrow", index=False)
+    os.replace(ruta_temporal, ruta_parquet)
+    logger.info("{} convertido a {} ({} filas)".format(ruta_csv, ruta_parquet, len(data)))
+
+
+if __name__ == "__main__":
+    convertir_a_parquet(ruta_csv, ruta_parquet)
@@ -1,2 +1,10 @@
 #!/bin/bash
-python /opt/dash/tablero/app_tablero.py
\ No newline at end of file
+# WORKERS > 1 inicia varios procesos con gunicorn; el cubo de ventas se escribe una vez en archivos mapeados
+# en memoria (DASH_MEMORIA_COMPARTIDA) y todos los workers leen las mismas páginas
+WORKERS=${WORKERS:-1}
+
+if [ "$WORKERS" -gt 1 ]; then
+    DASH_MEMORIA_COMPARTIDA=1 gunicorn app_tablero:server --chdir /opt/dash/tablero --workers $WORKERS --preload --bind 0.0.0.0:8050
+else
+    python /opt/dash/tablero/app_tablero.py
+fi
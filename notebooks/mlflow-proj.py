@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 # Importar librerías necesarias
+import os
+import sys
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import OneHotEncoder
@@ -18,9 +20,22 @@ from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestRegressor
 from xgboost import XGBRegressor
 
-# Cargar datos limpios
+sys.path.append('../src')
+from data_process import leer_parquet
+
+# Cargar datos limpios. Si existe el dataset Parquet de la capa silver (data_process.py --formato parquet) se leen
+# solo las columnas que usa el modelo. Las columnas de texto vienen como categóricas y 'Código Producto' como texto:
+# se convierten a los tipos que tienen al leer el CSV (texto e int64), para que el OneHotEncoder aprenda las mismas
+# categorías que recibe la API
 file_path = '../data/silver/ExporteCOL2022_2023_2024_clean.csv'
-df = pd.read_csv(file_path)
+parquet_path = '../data/silver/ExporteCOL2022_2023_2024_clean.parquet'
+if os.path.exists(parquet_path):
+    df = leer_parquet(parquet_path, columnas=['Año', 'Mes', 'Uen', 'Regional', 'Canal Comercial', 'Marquilla',
+                                              'Código Producto', 'Producto', 'Ventas'])
+    df = df.astype({column: str for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+    df = df.astype({'Año': 'int64', 'Mes': 'int64', 'Código Producto': 'int64'})
+else:
+    df = pd.read_csv(file_path)
 
 # Calcular las ventas totales por producto
 ventas_por_producto = df.groupby('Código Producto')['Ventas'].sum().reset_index()
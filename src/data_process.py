@@ -1,67 +1,540 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
-# Crear el path al archivo de datos en la carpeta bronze
+# Crear el path al archivo de datos en la carpeta bronze y al archivo limpio en la carpeta silver
 file_path = Path('../data/bronze/ExporteCOL2022_2023_2024conRegional.csv')
+clean_file_path = Path('../data/silver/ExporteCOL2022_2023_2024_clean.csv')
+
+# Columnas numéricas que vienen con coma decimal en el archivo bronze
+columnas_numericas = ['Ventas Galones', 'Ventas', 'Utilidad Bruta', 'Costos', 'Margen']
+
+
+# Función para cargar el archivo CSV de la capa bronze, completo o por bloques de tamano_bloque filas. Las columnas
+# de columnas_texto se leen como texto (además de 'Código Producto')
+def leer_bronze(ruta, tamano_bloque=None, columnas_texto=()):
+    # 'Código Producto' se lee como texto y las columnas numéricas se convierten al leer, con coma decimal
+    # y "#DIV/0!" como valor vacío
+    return pd.read_csv(ruta, on_bad_lines='skip', sep=';', decimal=',',
+                       dtype={column: str for column in ['Código Producto', *columnas_texto]},
+                       na_values={column: ['#DIV/0!'] for column in columnas_numericas}, chunksize=tamano_bloque)
+
+
+# Función para convertir a números las columnas con coma decimal que no se pudieron convertir al leer
+def convertir_numericas(df):
+    for column in columnas_numericas:
+        if column not in df.columns:
+            print(f"Advertencia: La columna '{column}' no existe en los datos.")
+        elif not pd.api.types.is_numeric_dtype(df[column]):
+            # La columna tiene valores que no son números con coma decimal (por ejemplo con punto decimal o textos):
+            # se reemplazan comas por puntos, se eliminan espacios y los valores inválidos quedan vacíos
+            df[column] = pd.to_numeric(df[column].astype(str).str.replace(',', '.').str.strip(), errors='coerce')
+    return df
+
+
+# Función para calcular en una sola máscara todos los filtros de filas de la limpieza
+def mascara_filas(df):
+    # Excluir filas con valores vacíos o que contienen "#DIV/0!" en cualquier columna
+    mascara = df.notna().all(axis=1)
+    for column in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[column]):
+            mascara &= df[column].ne('#DIV/0!')
+
+    # Excluir filas con margen, ventas en galones, ventas en dinero, utilidad bruta y costos negativos
+    for column in ['Margen', 'Ventas Galones', 'Ventas', 'Utilidad Bruta', 'Costos']:
+        mascara &= df[column] >= 0
+
+    # Excluir filas donde la columna "Producto" contiene la palabra "KIT"
+    mascara &= ~df['Producto'].str.contains('KIT', case=False, na=False)
+    return mascara
+
+
+# Función para obtener el Año y el Mes de cada fila como números, vacíos en las filas donde no son válidos
+# (por ejemplo líneas incompletas o encabezados repetidos al unir exports)
+def anio_mes(df):
+    return pd.to_numeric(df['Año'], errors='coerce'), pd.to_numeric(df['Mes'], errors='coerce')
+
+
+# Función para combinar los tipos de las columnas de varias partes de un archivo como quedarían al leerlo completo
+# (si una parte tiene decimales o vacíos la columna completa es float, y si tiene textos es object)
+def combinar_tipos(tipos, nuevos):
+    for column, tipo in nuevos.items():
+        tipo = np.dtype(tipo) if pd.api.types.is_numeric_dtype(tipo) else np.dtype(object)
+        tipos[column] = np.result_type(tipos.get(column, tipo), tipo)
+    return tipos
+
+
+# Función para importar pyarrow, que solo se requiere para leer y escribir Parquet
+def importar_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("El formato Parquet requiere pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+# Función para construir el esquema Parquet a partir de los tipos de las columnas. Las columnas de texto se guardan
+# con codificación por diccionario (al leerlas con pandas quedan como categóricas)
+def esquema_parquet(tipos):
+    pa, _ = importar_pyarrow()
+    return pa.schema([(column, pa.from_numpy_dtype(np.dtype(tipo)) if pd.api.types.is_numeric_dtype(tipo)
+                       else pa.dictionary(pa.int32(), pa.string()))
+                      for column, tipo in tipos.items()])
+
+
+# Función para preparar la carpeta temporal en la que se escribe un dataset Parquet antes de reemplazar la final
+def carpeta_temporal_parquet(ruta_salida):
+    carpeta = Path(f"{ruta_salida}.tmp")
+    shutil.rmtree(carpeta, ignore_errors=True)
+    return carpeta
 
-# Cargar el archivo CSV en un DataFrame de pandas
-df = pd.read_csv(file_path, on_bad_lines='skip', sep=';')
 
-# Mostrar las primeras filas del DataFrame para revisar la estructura
-print(df.head())
+# Función para escribir una parte de los datos en un dataset Parquet, con una carpeta por cada valor de las columnas
+# de partición (por ejemplo Año=2023/Regional=...) y estadísticas por columna en cada archivo. Los archivos de
+# cada parte empiezan con su nombre, para que una parte no reemplace los archivos de otra.
+def escribir_parquet(df, carpeta, esquema, columnas_particion, parte):
+    pa, pq = importar_pyarrow()
+    tabla = pa.Table.from_pandas(df, schema=esquema, preserve_index=False)
+    pq.write_to_dataset(tabla, carpeta, partition_cols=list(columnas_particion), basename_template=f"{parte}-{{i}}.parquet",
+                        write_statistics=True)
 
-# Crear una copia del DataFrame original
-df_copy = df.copy()
 
-# Realizar las transformaciones en la copia
-# Convertir 'Código Producto' a tipo string
-df_copy['Código Producto'] = df_copy['Código Producto'].astype(str)
+# Función para terminar un dataset Parquet escrito en la carpeta temporal: se guarda el esquema completo en
+# _common_metadata (orden y tipos de todas las columnas, incluidas las de partición) y se reemplaza la carpeta final
+def finalizar_parquet(carpeta, ruta_salida, esquema):
+    _, pq = importar_pyarrow()
+    carpeta.mkdir(parents=True, exist_ok=True)
+    pq.write_metadata(esquema, carpeta / '_common_metadata')
+    if Path(ruta_salida).is_dir():
+        shutil.rmtree(ruta_salida)
+    os.replace(carpeta, ruta_salida)
 
-for column in ['Ventas Galones', 'Ventas', 'Utilidad Bruta', 'Costos', 'Margen']:
-    if column in df_copy.columns:
-        # Convertir la columna a string, gestionando NaN
-        df_copy[column] = df_copy[column].astype(str)
-        # Reemplazar comas por puntos y eliminar espacios en blanco
-        df_copy[column] = df_copy[column].str.replace(',', '.').str.strip()
-        # Convertir a tipo float después de limpiar
-        df_copy[column] = pd.to_numeric(df_copy[column], errors='coerce')
+
+# Función para guardar un DataFrame completo como dataset Parquet particionado
+def guardar_parquet(df, ruta_salida, columnas_particion):
+    esquema = esquema_parquet(df.dtypes)
+    carpeta = carpeta_temporal_parquet(ruta_salida)
+    escribir_parquet(df, carpeta, esquema, columnas_particion, 'parte')
+    finalizar_parquet(carpeta, ruta_salida, esquema)
+
+
+# Función para leer un dataset Parquet de las capas silver o gold solo con las columnas y filas necesarias. Los
+# filtros (por ejemplo [('Año', '>=', 2023)]) descartan carpetas completas en las columnas de partición y archivos
+# por sus estadísticas en las demás. Las columnas de partición se devuelven con su tipo y posición originales.
+def leer_parquet(ruta, columnas=None, filtros=None):
+    pa, pq = importar_pyarrow()
+    esquema = pq.read_schema(Path(ruta) / '_common_metadata')
+    tabla = pq.read_table(ruta, columns=columnas, filters=filtros)
+    columnas = columnas or esquema.names
+    tabla = tabla.select(columnas).cast(pa.schema([esquema.field(column) for column in columnas]))
+    return tabla.to_pandas()
+
+
+# Función para limpiar el archivo bronze completo en memoria
+def procesar_completo(ruta_entrada, ruta_salida, formato='csv', columnas_particion=('Año',)):
+    df = leer_bronze(ruta_entrada)
+
+    # Mostrar las primeras filas del DataFrame para revisar la estructura
+    print(df.head())
+
+    df = convertir_numericas(df)
+
+    # Verificar que las conversiones sean correctas
+    print(df.info())
+    print(df.describe())
+
+    df = df[mascara_filas(df)]
+
+    # Contar cuántas ventas tiene cada producto y eliminar los productos con una única venta
+    ventas_por_producto = df['Código Producto'].value_counts()
+    productos_una_venta = ventas_por_producto[ventas_por_producto == 1].index
+    df = df[~df['Código Producto'].isin(productos_una_venta)]
+
+    # Verificar que las exclusiones se han realizado correctamente
+    print(df.info())
+    print(df.describe())
+
+    # Guardar el DataFrame limpio en un nuevo archivo CSV o en un dataset Parquet
+    if formato == 'parquet':
+        guardar_parquet(df, ruta_salida, columnas_particion)
     else:
-        print(f"Advertencia: La columna '{column}' no existe en los datos.")
+        df.to_csv(ruta_salida, index=False)
 
-# Verificar que las conversiones sean correctas
-print(df_copy.info())
-print(df_copy.describe())
 
-# Excluir filas con margen negativo
-df_copy = df_copy[df_copy['Margen'] >= 0]
+# Función para obtener las columnas que quedan como texto al leer el archivo bronze completo (por ejemplo 'Año' o
+# las columnas Numérica cuando hay líneas incompletas o encabezados repetidos), recorriéndolo por bloques. Las
+# columnas numéricas con coma decimal no se incluyen porque convertir_numericas las convierte siempre
+def columnas_texto_bronze(ruta, tamano_bloque):
+    tipos = {}
+    for bloque in leer_bronze(ruta, tamano_bloque):
+        combinar_tipos(tipos, bloque.dtypes)
+    return [column for column, tipo in tipos.items() if tipo == object and column not in columnas_numericas]
 
-# Excluir filas que contienen "#DIV/0!" en cualquier columna
-df_copy = df_copy.replace("#DIV/0!", float('nan')).dropna()
 
-# Excluir filas donde la columna "Producto" contiene la palabra "KIT"
-df_copy = df_copy[~df_copy['Producto'].str.contains('KIT', case=False, na=False)]
+# Función para limpiar el archivo bronze por bloques, con la memoria acotada por el tamaño del bloque.
+# Antes de limpiar se recorre el archivo para conocer las columnas que el procesamiento en memoria lee como texto, y
+# se leen como texto en todos los bloques; si no, un bloque sin filas inválidas las lee como números (y por ejemplo
+# el valor 2 se escribe como 2.0 si el bloque tiene vacíos).
+# Primera pasada: se limpia cada bloque, se guarda en una carpeta temporal y se cuentan las ventas por producto.
+# Segunda pasada: se recorren los bloques limpios eliminando los productos con una única venta.
+def procesar_por_bloques(ruta_entrada, ruta_salida, tamano_bloque, formato='csv', columnas_particion=('Año',)):
+    ruta_temporal = carpeta_temporal_parquet(ruta_salida) if formato == 'parquet' else Path(f"{ruta_salida}.tmp")
+    ventas_por_producto = pd.Series(dtype='float64')
+    tipos = {}
+    filas_leidas = 0
+    columnas_texto = columnas_texto_bronze(ruta_entrada, tamano_bloque)
 
-# Excluir filas con ventas en galones, ventas en dinero, costos y utilidad brutas negativas
-df_copy = df_copy[df_copy['Ventas Galones'] >= 0]
-df_copy = df_copy[df_copy['Ventas'] >= 0]
-df_copy = df_copy[df_copy['Utilidad Bruta'] >= 0]
-df_copy = df_copy[df_copy['Costos'] >= 0]
+    with tempfile.TemporaryDirectory(dir=Path(ruta_salida).parent) as carpeta_bloques:
+        rutas_bloques = []
+        for i, bloque in enumerate(leer_bronze(ruta_entrada, tamano_bloque, columnas_texto)):
+            filas_leidas += len(bloque)
+            bloque = convertir_numericas(bloque)
 
-# Contar cuántas ventas tiene cada producto
-ventas_por_producto = df_copy.groupby('Código Producto')['Ventas Galones'].count()
+            # Tipo de cada columna como quedaría al leer el archivo completo, para que la salida sea igual a la del
+            # procesamiento en memoria
+            combinar_tipos(tipos, bloque.dtypes)
 
-# Identificar los productos con solo una venta
-productos_una_venta = ventas_por_producto[ventas_por_producto == 1].index
+            bloque = bloque[mascara_filas(bloque)]
+            ventas_por_producto = ventas_por_producto.add(bloque['Código Producto'].value_counts(), fill_value=0)
+            rutas_bloques.append(Path(carpeta_bloques) / f"bloque_{i}.pkl")
+            bloque.to_pickle(rutas_bloques[-1])
+            print(f"Bloque {i + 1}: {filas_leidas} filas leídas")
 
-# Eliminar productos con una única venta de la base de datos
-df_copy = df_copy[~df_copy['Código Producto'].isin(productos_una_venta)]
+        productos_una_venta = ventas_por_producto.index[ventas_por_producto == 1]
+        if formato == 'parquet':
+            esquema = esquema_parquet(tipos)
 
-# Verificar que las exclusiones se han realizado correctamente
-print(df_copy.info())
-print(df_copy.describe())
+        filas_limpias = 0
+        for i, ruta_bloque in enumerate(rutas_bloques):
+            bloque = pd.read_pickle(ruta_bloque)
+            bloque = bloque[~bloque['Código Producto'].isin(productos_una_venta)]
+            # Solo se cambian las columnas numéricas cuyo tipo en el bloque no coincide con el del archivo completo
+            bloque = bloque.astype({column: tipos[column] for column in bloque.columns
+                                    if pd.api.types.is_numeric_dtype(bloque[column]) and bloque[column].dtype != tipos[column]})
+            filas_limpias += len(bloque)
+            if formato == 'parquet':
+                escribir_parquet(bloque, ruta_temporal, esquema, columnas_particion, f"bloque{i:05d}")
+            else:
+                bloque.to_csv(ruta_temporal, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+            os.remove(ruta_bloque)
+
+    # Reemplazar el archivo limpio solo cuando está completo
+    if formato == 'parquet':
+        finalizar_parquet(ruta_temporal, ruta_salida, esquema)
+    else:
+        os.replace(ruta_temporal, ruta_salida)
+    print(f"Filas leídas: {filas_leidas}, filas limpias: {filas_limpias}, productos con una única venta: {len(productos_una_venta)}")
+
+
+# Función para descubrir los archivos CSV de la capa bronze en una carpeta
+def archivos_bronze(carpeta):
+    return sorted(Path(carpeta).glob('*.csv'))
+
+
+# Función para dividir un archivo en rangos de bytes de unos tamano_rango bytes que terminan en un fin de línea,
+# para repartirlos entre los procesos (los exports no tienen campos con saltos de línea). Devuelve también la línea
+# de encabezado, que se agrega a cada rango.
+def rangos_archivo(ruta, tamano_rango):
+    tamano = os.path.getsize(ruta)
+    rangos = []
+    with open(ruta, 'rb') as archivo:
+        encabezado = archivo.readline()
+        inicio = archivo.tell()
+        while inicio < tamano:
+            archivo.seek(min(inicio + tamano_rango, tamano))
+            archivo.readline()
+            rangos.append((inicio, archivo.tell()))
+            inicio = archivo.tell()
+    return encabezado, rangos
+
+
+# Función que ejecuta cada proceso de la ingesta en paralelo: limpia un rango de bytes de un archivo bronze.
+# Devuelve las filas limpias, las filas leídas, los tipos de las columnas antes de limpiar y los períodos (Año, Mes)
+# que aparecen en el rango
+def limpiar_rango(ruta, encabezado, inicio, fin, columnas):
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(inicio)
+        datos = archivo.read(fin - inicio)
+    df = convertir_numericas(leer_bronze(io.BytesIO(encabezado + datos))[columnas])
+    anios, meses = anio_mes(df)
+    validos = anios.notna() & meses.notna()
+    periodos = set(zip(anios[validos].astype(int), meses[validos].astype(int)))
+    return df[mascara_filas(df)], len(df), df.dtypes, periodos
 
-# Guardar el DataFrame limpio en un nuevo archivo CSV
-clean_file_path = Path('../data/silver/ExporteCOL2022_2023_2024_clean.csv')
 
+# Función para limpiar en paralelo varios archivos de la capa bronze y unirlos en un solo archivo silver. Cada archivo
+# se divide en rangos que se limpian en un pool de procesos (el tiempo baja con el número de núcleos). Si varios
+# exports tienen el mismo período (Año, Mes) se usan solo las filas del más reciente: el que llega al período más
+# reciente o, si llegan al mismo, el modificado por última vez. Los productos con una única venta se eliminan sobre
+# el resultado unido.
+def procesar_paralelo(rutas_entrada, ruta_salida, procesos=None, formato='csv', columnas_particion=('Año',)):
+    procesos = procesos or os.cpu_count()
 
-df_copy.to_csv(clean_file_path, index=False)
\ No newline at end of file
+    # Todos los archivos deben tener las columnas del export con más columnas; los demás se omiten
+    columnas_archivo = {ruta: list(pd.read_csv(ruta, sep=';', nrows=0).columns) for ruta in rutas_entrada}
+    columnas = max(columnas_archivo.values(), key=len)
+    rutas = []
+    for ruta, columnas_ruta in columnas_archivo.items():
+        if set(columnas) <= set(columnas_ruta):
+            rutas.append(ruta)
+        else:
+            print(f"Advertencia: {ruta} no tiene las columnas {sorted(set(columnas) - set(columnas_ruta))}, se omite.")
+
+    tamano_rango = max(sum(os.path.getsize(ruta) for ruta in rutas) // (procesos * 4), 1 << 20)
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        tareas = []
+        for ruta in rutas:
+            encabezado, rangos = rangos_archivo(ruta, tamano_rango)
+            tareas += [(ruta, pool.submit(limpiar_rango, ruta, encabezado, inicio, fin, columnas)) for inicio, fin in rangos]
+        partes = [(ruta, *tarea.result()) for ruta, tarea in tareas]
+    print(f"Archivos: {len(rutas)}, rangos procesados: {len(partes)}, procesos: {procesos}")
+
+    # Tipos del archivo unido y períodos de cada export
+    tipos, periodos = {}, {ruta: set() for ruta in rutas}
+    for ruta, _, filas, tipos_parte, periodos_parte in partes:
+        if filas:
+            combinar_tipos(tipos, tipos_parte)
+        periodos[ruta] |= periodos_parte
+
+    # Cada período se toma del export más reciente que lo tiene
+    origen = {}
+    for ruta in sorted(rutas, key=lambda ruta: (max(periodos[ruta], default=(0, 0)), os.path.getmtime(ruta))):
+        origen.update(dict.fromkeys(periodos[ruta], ruta))
+    for ruta in rutas:
+        propios = {periodo for periodo in periodos[ruta] if origen[periodo] == ruta}
+        print(f"{ruta}: {len(propios)} de {len(periodos[ruta])} períodos")
+
+    # Las filas sin Año o Mes válidos no pertenecen a ningún período y se descartan, como en la limpieza completa
+    limpios = []
+    for ruta, limpio, _, _, _ in partes:
+        periodos_limpio = pd.MultiIndex.from_arrays(anio_mes(limpio))
+        limpio = limpio[periodos_limpio.isin([periodo for periodo, ruta_origen in origen.items() if ruta_origen == ruta])]
+        if len(limpio):
+            limpios.append(limpio)
+    if not limpios:
+        raise SystemExit("No quedaron filas limpias en los archivos bronze")
+    df = pd.concat(limpios, ignore_index=True)
+
+    # Solo se cambian las columnas numéricas cuyo tipo no coincide con el de los archivos completos
+    df = df.astype({column: tipos[column] for column in df.columns
+                    if pd.api.types.is_numeric_dtype(df[column]) and df[column].dtype != tipos[column]})
+
+    # Contar cuántas ventas tiene cada producto y eliminar los productos con una única venta
+    ventas_por_producto = df['Código Producto'].value_counts()
+    productos_una_venta = ventas_por_producto[ventas_por_producto == 1].index
+    df = df[~df['Código Producto'].isin(productos_una_venta)]
+
+    if formato == 'parquet':
+        guardar_parquet(df, ruta_salida, columnas_particion)
+    else:
+        df.to_csv(ruta_salida, index=False)
+    print(f"Filas leídas: {sum(parte[2] for parte in partes)}, filas limpias: {len(df)}, productos con una única venta: {len(productos_una_venta)}")
+
+
+# Versión de las reglas de limpieza: al cambiarla se invalidan las particiones del modo incremental
+version_limpieza = 1
+
+
+# Función para obtener la carpeta con las particiones por Año/Mes de un archivo de salida (modo incremental)
+def carpeta_particiones(ruta_salida):
+    ruta_salida = Path(ruta_salida)
+    return ruta_salida.with_name(f"{ruta_salida.stem}_particiones")
+
+
+# Función para leer el manifiesto de una carpeta de particiones (vacío si aún no existe)
+def leer_manifiesto(carpeta):
+    ruta = Path(carpeta) / 'manifiesto.json'
+    if not ruta.exists():
+        return {'particiones': {}}
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+# Función para guardar el manifiesto de una carpeta de particiones
+def guardar_manifiesto(carpeta, manifiesto):
+    ruta = Path(carpeta) / 'manifiesto.json'
+    # json.dumps usa el codificador en C, json.dump escribe por partes y es mucho más lento con manifiestos grandes
+    with open(f"{ruta}.tmp", 'w', encoding='utf-8') as archivo:
+        archivo.write(json.dumps(manifiesto, ensure_ascii=False))
+    os.replace(f"{ruta}.tmp", ruta)
+
+
+# Función para calcular el hash del contenido de una partición del archivo bronze
+def hash_particion(df):
+    huella = hashlib.sha256(json.dumps([version_limpieza, list(df.columns)], ensure_ascii=False).encode())
+    huella.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return huella.hexdigest()
+
+
+# Función para obtener los tipos con los que se lee una partición: las columnas se leen como texto, para copiarlas
+# igual a la salida, salvo las numéricas cuyo tipo en el archivo completo es distinto (enteros que quedan como float)
+def tipos_lectura(tipos_particion, tipos_globales):
+    return {column: tipo if tipo != object and tipo != np.dtype(tipos_particion.get(column, object)) else str
+            for column, tipo in tipos_globales.items()}
+
+
+# Función para obtener las columnas de una partición: las guardadas en el manifiesto o, en particiones escritas antes
+# de guardarlas, las del encabezado de su CSV
+def obtener_columnas_particion(carpeta, nombre, datos):
+    if 'columnas' in datos:
+        return datos['columnas']
+    return list(pd.read_csv(Path(carpeta) / f"{nombre}.csv", nrows=0).columns)
+
+
+# Función para verificar que todas las particiones tengan las mismas columnas antes de unirlas en un solo archivo
+def verificar_columnas(carpeta, particiones):
+    columnas = {nombre: obtener_columnas_particion(carpeta, nombre, datos) for nombre, datos in particiones.items()}
+    referencia = columnas[min(columnas)]
+    distintas = sorted(nombre for nombre, columnas_nombre in columnas.items() if columnas_nombre != referencia)
+    if distintas:
+        raise SystemExit(f"Las particiones {distintas} de {carpeta} no tienen las columnas {referencia}")
+
+
+# Función para limpiar en modo incremental. El archivo bronze se separa por Año/Mes y solo se limpian los meses
+# nuevos o con contenido distinto (según su hash); los demás se conservan de las ejecuciones anteriores, de modo
+# que un export con los meses recientes actualiza solo esos meses. El manifiesto guarda por mes los conteos y las
+# ventas por producto, con los que se eliminan los productos con una única venta sin volver a leer los datos.
+def procesar_incremental(ruta_entrada, ruta_salida, formato='csv', columnas_particion=('Año',)):
+    carpeta = carpeta_particiones(ruta_salida)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    manifiesto = leer_manifiesto(carpeta)
+
+    df = convertir_numericas(leer_bronze(ruta_entrada))
+    tipos_archivo = {column: str(tipo) for column, tipo in combinar_tipos({}, df.dtypes).items()}
+
+    # Las filas sin Año o Mes válidos no pertenecen a ningún mes y se descartan, como en la limpieza completa
+    anios, meses = anio_mes(df)
+    grupos = df.groupby([anios, meses])
+
+    # Los meses que este export no trae se conservan, y para unirlos con los nuevos deben tener las mismas columnas
+    # (por ejemplo, un export sin 'Regional' no se puede mezclar con meses limpiados con 'Regional')
+    columnas = list(df.columns)
+    nombres = {f"{int(anio)}-{int(mes):02d}" for anio, mes in grupos.groups}
+    anteriores = {nombre: obtener_columnas_particion(carpeta, nombre, datos)
+                  for nombre, datos in manifiesto['particiones'].items() if nombre not in nombres}
+    distintas = sorted(nombre for nombre, columnas_nombre in anteriores.items() if columnas_nombre != columnas)
+    if distintas:
+        columnas_anteriores = anteriores[distintas[0]]
+        raise SystemExit(f"Las columnas de {ruta_entrada} no coinciden con las de los meses {distintas} ya procesados "
+                         f"(faltan {sorted(set(columnas_anteriores) - set(columnas))}, "
+                         f"sobran {sorted(set(columnas) - set(columnas_anteriores))}); vuelva a limpiar esos meses con "
+                         f"un export con las mismas columnas")
+
+    actualizadas = []
+    for (anio, mes), grupo in grupos:
+        nombre = f"{int(anio)}-{int(mes):02d}"
+        hash_grupo = hash_particion(grupo)
+        if manifiesto['particiones'].get(nombre, {}).get('hash') == hash_grupo:
+            continue
+
+        limpio = grupo[mascara_filas(grupo)]
+        ruta_particion = carpeta / f"{nombre}.csv"
+        limpio.to_csv(f"{ruta_particion}.tmp", index=False)
+        os.replace(f"{ruta_particion}.tmp", ruta_particion)
+        manifiesto['particiones'][nombre] = {
+            'hash': hash_grupo,
+            'filas': len(limpio),
+            'columnas': columnas,
+            'tipos': tipos_archivo,
+            'conteos': {codigo: int(n) for codigo, n in limpio['Código Producto'].value_counts().items()},
+            'ventas': {codigo: float(v) for codigo, v in limpio.groupby('Código Producto')['Ventas'].sum().items()},
+        }
+        actualizadas.append(nombre)
+
+    guardar_manifiesto(carpeta, manifiesto)
+    print(f"Particiones actualizadas: {len(actualizadas)} {actualizadas}, sin cambios: {len(manifiesto['particiones']) - len(actualizadas)}")
+    if not actualizadas and Path(ruta_salida).exists():
+        return
+
+    # Unir las particiones en el archivo limpio, eliminando los productos con una única venta en todos los meses
+    conteos, tipos = Counter(), {}
+    for datos in manifiesto['particiones'].values():
+        conteos.update(datos['conteos'])
+        combinar_tipos(tipos, datos['tipos'])
+    productos_una_venta = {codigo for codigo, n in conteos.items() if n == 1}
+    verificar_columnas(carpeta, manifiesto['particiones'])
+
+    # En Parquet se vuelven a escribir todos los meses, un archivo por mes, con los tipos del archivo completo
+    if formato == 'parquet':
+        esquema = esquema_parquet(tipos)
+        carpeta_temporal = carpeta_temporal_parquet(ruta_salida)
+        for nombre in sorted(manifiesto['particiones']):
+            particion = pd.read_csv(carpeta / f"{nombre}.csv", dtype={column: str if tipo == object else tipo for column, tipo in tipos.items()},
+                                    keep_default_na=False, float_precision='round_trip')
+            particion = particion[~particion['Código Producto'].isin(productos_una_venta)]
+            escribir_parquet(particion, carpeta_temporal, esquema, columnas_particion, nombre)
+        finalizar_parquet(carpeta_temporal, ruta_salida, esquema)
+        print(f"Productos con una única venta: {len(productos_una_venta)}")
+        return
+
+    # Las particiones sin productos con una única venta y con los mismos tipos del archivo completo se copian tal
+    # cual; las demás se leen, se filtran y se vuelven a escribir
+    ruta_temporal = Path(f"{ruta_salida}.tmp")
+    with open(ruta_temporal, 'wb') as salida:
+        for i, nombre in enumerate(sorted(manifiesto['particiones'])):
+            datos = manifiesto['particiones'][nombre]
+            tipos_particion = tipos_lectura(datos['tipos'], tipos)
+            with open(carpeta / f"{nombre}.csv", 'rb') as archivo:
+                encabezado = archivo.readline()
+                if i == 0:
+                    salida.write(encabezado)
+                if all(tipo is str for tipo in tipos_particion.values()) and productos_una_venta.isdisjoint(datos['conteos']):
+                    shutil.copyfileobj(archivo, salida)
+                    continue
+                archivo.seek(0)
+                particion = pd.read_csv(archivo, dtype=tipos_particion, keep_default_na=False, float_precision='round_trip')
+            particion = particion[~particion['Código Producto'].isin(productos_una_venta)]
+            particion.to_csv(salida, header=False, index=False, encoding='utf-8')
+    os.replace(ruta_temporal, ruta_salida)
+    print(f"Productos con una única venta: {len(productos_una_venta)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Limpieza de los datos de la capa bronze a la capa silver')
+    parser.add_argument('--entrada', type=Path, default=file_path,
+                        help='Archivo CSV de la capa bronze, o una carpeta para limpiar en paralelo todos sus archivos CSV')
+    parser.add_argument('--salida', type=Path, default=clean_file_path, help='Archivo CSV limpio de la capa silver')
+    parser.add_argument('--tamano-bloque', type=int, default=0,
+                        help='Filas por bloque para procesar el archivo por partes; con 0 se procesa completo en memoria')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Limpiar solo los meses nuevos o modificados y unirlos con las particiones ya procesadas')
+    parser.add_argument('--formato', choices=['csv', 'parquet'], default='csv',
+                        help='Formato de salida; parquet guarda un dataset particionado por Año (requiere pyarrow)')
+    parser.add_argument('--particion-regional', action='store_true',
+                        help='En Parquet, particionar también por Regional')
+    parser.add_argument('--procesos', type=int, default=None,
+                        help='Procesos para la ingesta en paralelo (por defecto, uno por núcleo); con un archivo de '
+                             'entrada, indicarlo lo limpia por rangos en paralelo')
+    args = parser.parse_args()
+
+    # Con una carpeta se limpian en paralelo todos los archivos CSV que contiene
+    paralelo = args.entrada.is_dir() or args.procesos is not None
+    if paralelo and (args.incremental or args.tamano_bloque > 0):
+        parser.error('la ingesta en paralelo no se puede combinar con --incremental ni con --tamano-bloque')
+
+    # El dataset Parquet es una carpeta; por defecto se llama como el archivo CSV con extensión .parquet
+    if args.formato == 'parquet' and args.salida.suffix == '.csv':
+        args.salida = args.salida.with_suffix('.parquet')
+    columnas_particion = ['Año', 'Regional'] if args.particion_regional else ['Año']
+
+    if paralelo:
+        rutas = archivos_bronze(args.entrada) if args.entrada.is_dir() else [args.entrada]
+        procesar_paralelo(rutas, args.salida, args.procesos, args.formato, columnas_particion)
+    elif args.incremental:
+        procesar_incremental(args.entrada, args.salida, args.formato, columnas_particion)
+    elif args.tamano_bloque > 0:
+        procesar_por_bloques(args.entrada, args.salida, args.tamano_bloque, args.formato, columnas_particion)
+    else:
+        procesar_completo(args.entrada, args.salida, args.formato, columnas_particion)
+    print(f"Archivo guardado en {args.salida}")
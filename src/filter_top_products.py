@@ -1,43 +1,200 @@
-import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from collections import Counter
 from pathlib import Path
-from sklearn.preprocessing import LabelEncoder
 
-# Cargar datos limpios desde el nivel silver
-file_path = '../data/silver/ExporteCOL2022_2023_2024_clean.csv'
-df = pd.read_csv(file_path)
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
 
-# Calcular las ventas totales por producto
-ventas_por_producto = df.groupby('Código Producto')['Ventas'].sum().reset_index()
+from data_process import (carpeta_particiones, carpeta_temporal_parquet, combinar_tipos, escribir_parquet, esquema_parquet,
+                          finalizar_parquet, guardar_manifiesto, guardar_parquet, leer_manifiesto, leer_parquet, tipos_lectura,
+                          verificar_columnas)
 
-# Ordenar productos por ventas en orden descendente
-ventas_por_producto = ventas_por_producto.sort_values(by='Ventas', ascending=False)
+# Cargar datos limpios desde el nivel silver
+file_path = Path('../data/silver/ExporteCOL2022_2023_2024_clean.csv')
 
-# Calcular el porcentaje acumulado de ventas
-ventas_por_producto['Porcentaje Acumulado'] = ventas_por_producto['Ventas'].cumsum() / ventas_por_producto['Ventas'].sum()
+# Definir el path de salida para el archivo en el nivel gold
+clean_file_path = Path('../data/gold/ExporteCOL2022_2023_2024_top_products_encoded.csv')
 
 # Definir el umbral de contribución, en este caso, el 80%
 umbral_contribucion = 0.80
 
-# Seleccionar solo los productos que representan el 80% de las ventas
-productos_principales = ventas_por_producto[ventas_por_producto['Porcentaje Acumulado'] <= umbral_contribucion]
+# Variables categóricas con One-Hot Encoding (pocos valores únicos); 'Marquilla' se codifica con LabelEncoder
+columnas_one_hot = ['Uen', 'Regional', 'Canal Comercial']
 
-# Filtrar el DataFrame original para incluir solo los productos principales
-df_principales = df[df['Código Producto'].isin(productos_principales['Código Producto'])]
 
-# Verificar el tamaño del nuevo conjunto de datos
-print("Dimensiones del conjunto de datos filtrado:", df_principales.shape)
+# Función para seleccionar los productos que representan el 80% de las ventas, a partir de las ventas por producto
+def seleccionar_productos_principales(ventas_por_producto):
+    # Ordenar productos por ventas en orden descendente
+    ventas_por_producto = ventas_por_producto.sort_values(by='Ventas', ascending=False)
 
-# Codificación de variables categóricas
-# One-Hot Encoding para variables con pocos valores únicos
-df_encoded_principales = pd.get_dummies(df_principales, columns=['Uen', 'Regional', 'Canal Comercial'], drop_first=True)
+    # Calcular el porcentaje acumulado de ventas
+    ventas_por_producto['Porcentaje Acumulado'] = ventas_por_producto['Ventas'].cumsum() / ventas_por_producto['Ventas'].sum()
 
-# Codificación de 'Marquilla' con LabelEncoder
-label_encoder = LabelEncoder()
-df_encoded_principales['Marquilla'] = label_encoder.fit_transform(df_encoded_principales['Marquilla'])
+    # Seleccionar solo los productos que representan el 80% de las ventas
+    return ventas_por_producto[ventas_por_producto['Porcentaje Acumulado'] <= umbral_contribucion]['Código Producto']
 
-# Definir el path de salida para el archivo en el nivel gold
-clean_file_path = Path('../data/gold/ExporteCOL2022_2023_2024_top_products_encoded.csv')
 
-# Guardar el DataFrame filtrado en el archivo CSV
-df_encoded_principales.to_csv(clean_file_path, index=False)
-print(f"Archivo guardado en {clean_file_path}")
+# Función para codificar las variables categóricas con las categorías de todo el conjunto de datos,
+# para que cada parte de los datos quede con las mismas columnas y los mismos códigos
+def codificar(df_principales, categorias):
+    df_principales = df_principales.assign(**{column: pd.Categorical(df_principales[column], categories=categorias[column])
+                                              for column in columnas_one_hot})
+    df_encoded_principales = pd.get_dummies(df_principales, columns=columnas_one_hot, drop_first=True)
+
+    # Codificación de 'Marquilla' con LabelEncoder
+    label_encoder = LabelEncoder().fit(categorias['Marquilla'])
+    df_encoded_principales['Marquilla'] = label_encoder.transform(df_encoded_principales['Marquilla'])
+    return df_encoded_principales
+
+
+# Función para filtrar y codificar el archivo silver completo en memoria (CSV o dataset Parquet de data_process.py)
+def procesar_completo(ruta_entrada, ruta_salida, formato='csv'):
+    if Path(ruta_entrada).is_dir():
+        # Las columnas de texto del dataset Parquet se leen como categóricas y se pasan a texto, como en el CSV
+        df = leer_parquet(ruta_entrada)
+        df = df.astype({column: str for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+    else:
+        df = pd.read_csv(ruta_entrada)
+
+    # Calcular las ventas totales por producto y seleccionar los productos principales
+    ventas_por_producto = df.groupby('Código Producto')['Ventas'].sum().reset_index()
+    productos_principales = seleccionar_productos_principales(ventas_por_producto)
+
+    # Filtrar el DataFrame original para incluir solo los productos principales
+    df_principales = df[df['Código Producto'].isin(productos_principales)]
+
+    # Verificar el tamaño del nuevo conjunto de datos
+    print("Dimensiones del conjunto de datos filtrado:", df_principales.shape)
+
+    categorias = {column: sorted(df_principales[column].unique()) for column in columnas_one_hot + ['Marquilla']}
+    df_encoded_principales = codificar(df_principales, categorias)
+
+    # Guardar el DataFrame filtrado en el archivo CSV o en un dataset Parquet particionado por Año
+    if formato == 'parquet':
+        guardar_parquet(df_encoded_principales, ruta_salida, ['Año'])
+    else:
+        df_encoded_principales.to_csv(ruta_salida, index=False)
+
+
+# Función para filtrar y codificar en modo incremental, a partir de las particiones por Año/Mes de la capa silver
+# (data_process.py --incremental). Las ventas por producto para el 80% se suman desde el manifiesto de silver, y
+# solo se vuelven a codificar los meses que cambiaron en silver o todos si cambian los productos principales,
+# las categorías o los tipos de las columnas.
+def procesar_incremental(ruta_entrada, ruta_salida, formato='csv'):
+    carpeta_silver = carpeta_particiones(ruta_entrada)
+    manifiesto_silver = leer_manifiesto(carpeta_silver)
+    if not manifiesto_silver['particiones']:
+        raise SystemExit(f"No hay particiones en {carpeta_silver}, ejecute primero data_process.py --incremental")
+
+    carpeta = carpeta_particiones(ruta_salida)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    manifiesto = leer_manifiesto(carpeta)
+
+    # Conteos y ventas por producto de todos los meses, sin los productos con una única venta
+    conteos, ventas, tipos = Counter(), Counter(), {}
+    for datos in manifiesto_silver['particiones'].values():
+        conteos.update(datos['conteos'])
+        ventas.update(datos['ventas'])
+        combinar_tipos(tipos, datos['tipos'])
+    ventas_por_producto = pd.DataFrame(sorted((codigo, total) for codigo, total in ventas.items() if conteos[codigo] > 1),
+                                       columns=['Código Producto', 'Ventas'])
+    productos_principales = set(seleccionar_productos_principales(ventas_por_producto))
+
+    firma_principales = hashlib.sha256(json.dumps(sorted(productos_principales)).encode()).hexdigest()
+
+    # Valores de las variables codificadas en cada mes entre las filas de los productos principales. Se reutilizan
+    # los del manifiesto de gold para los meses sin cambios si los productos principales son los mismos
+    valores = {}
+    for nombre, datos in manifiesto_silver['particiones'].items():
+        anterior = manifiesto['particiones'].get(nombre, {})
+        if anterior.get('hash_silver') == datos['hash'] and anterior.get('principales') == firma_principales:
+            valores[nombre] = anterior['valores']
+            continue
+        particion = pd.read_csv(carpeta_silver / f"{nombre}.csv", usecols=['Código Producto'] + columnas_one_hot + ['Marquilla'],
+                                dtype=str, keep_default_na=False)
+        particion = particion[particion['Código Producto'].isin(productos_principales)]
+        valores[nombre] = {column: sorted(particion[column].unique()) for column in columnas_one_hot + ['Marquilla']}
+    categorias = {column: sorted(set().union(*(valores_mes[column] for valores_mes in valores.values())))
+                  for column in columnas_one_hot + ['Marquilla']}
+
+    firma = hashlib.sha256(json.dumps([firma_principales, categorias, {column: str(tipo) for column, tipo in tipos.items()}],
+                                      ensure_ascii=False).encode()).hexdigest()
+
+    actualizadas = []
+    for nombre, datos in manifiesto_silver['particiones'].items():
+        estado = {'hash_silver': datos['hash'], 'principales': firma_principales, 'valores': valores[nombre], 'firma': firma}
+        if manifiesto['particiones'].get(nombre) == estado:
+            continue
+
+        particion = pd.read_csv(carpeta_silver / f"{nombre}.csv", dtype=tipos_lectura(datos['tipos'], tipos),
+                                keep_default_na=False, float_precision='round_trip')
+        particion = codificar(particion[particion['Código Producto'].isin(productos_principales)], categorias)
+        ruta_particion = carpeta / f"{nombre}.csv"
+        particion.to_csv(f"{ruta_particion}.tmp", index=False)
+        os.replace(f"{ruta_particion}.tmp", ruta_particion)
+        manifiesto['particiones'][nombre] = estado
+        actualizadas.append(nombre)
+
+    # Eliminar los meses que ya no están en silver
+    for nombre in set(manifiesto['particiones']) - set(manifiesto_silver['particiones']):
+        os.remove(carpeta / f"{nombre}.csv")
+        del manifiesto['particiones'][nombre]
+
+    guardar_manifiesto(carpeta, manifiesto)
+    print(f"Particiones actualizadas: {len(actualizadas)} {actualizadas}, sin cambios: {len(manifiesto['particiones']) - len(actualizadas)}")
+    if not actualizadas and Path(ruta_salida).exists():
+        return
+    verificar_columnas(carpeta, manifiesto['particiones'])
+
+    # En Parquet se escribe un archivo por mes. Las columnas de silver conservan los tipos del archivo completo,
+    # 'Marquilla' queda con su código entero y las columnas del One-Hot Encoding son booleanas
+    if formato == 'parquet':
+        columnas = pd.read_csv(carpeta / f"{min(manifiesto['particiones'])}.csv", nrows=0).columns
+        tipos_gold = {column: np.dtype('int64') if column == 'Marquilla' else tipos.get(column, np.dtype(bool))
+                      for column in columnas}
+        esquema = esquema_parquet(tipos_gold)
+        carpeta_temporal = carpeta_temporal_parquet(ruta_salida)
+        for nombre in sorted(manifiesto['particiones']):
+            particion = pd.read_csv(carpeta / f"{nombre}.csv", dtype={column: str if tipo == object else tipo for column, tipo in tipos_gold.items()},
+                                    keep_default_na=False, float_precision='round_trip')
+            escribir_parquet(particion, carpeta_temporal, esquema, ['Año'], nombre)
+        finalizar_parquet(carpeta_temporal, ruta_salida, esquema)
+        print(f"Productos principales: {len(productos_principales)}")
+        return
+
+    # Todas las particiones tienen las mismas columnas: se unen copiando su contenido, con un solo encabezado
+    with open(f"{ruta_salida}.tmp", 'wb') as salida:
+        for i, nombre in enumerate(sorted(manifiesto['particiones'])):
+            with open(carpeta / f"{nombre}.csv", 'rb') as particion:
+                encabezado = particion.readline()
+                if i == 0:
+                    salida.write(encabezado)
+                shutil.copyfileobj(particion, salida)
+    os.replace(f"{ruta_salida}.tmp", ruta_salida)
+    print(f"Productos principales: {len(productos_principales)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Selección de los productos principales y codificación para la capa gold')
+    parser.add_argument('--entrada', type=Path, default=file_path, help='Archivo CSV o dataset Parquet limpio de la capa silver')
+    parser.add_argument('--salida', type=Path, default=clean_file_path, help='Archivo CSV codificado de la capa gold')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Usar las particiones por Año/Mes de silver y codificar solo los meses que cambiaron')
+    parser.add_argument('--formato', choices=['csv', 'parquet'], default='csv',
+                        help='Formato de salida; parquet guarda un dataset particionado por Año (requiere pyarrow)')
+    args = parser.parse_args()
+
+    # El dataset Parquet es una carpeta; por defecto se llama como el archivo CSV con extensión .parquet
+    if args.formato == 'parquet' and args.salida.suffix == '.csv':
+        args.salida = args.salida.with_suffix('.parquet')
+
+    if args.incremental:
+        procesar_incremental(args.entrada, args.salida, args.formato)
+    else:
+        procesar_completo(args.entrada, args.salida, args.formato)
+    print(f"Archivo guardado en {args.salida}")
@@ -0,0 +1,98 @@
+import pandas as pd
+import pytest
+
+from data_process import procesar_completo, procesar_incremental, procesar_paralelo, procesar_por_bloques
+
+encabezado = ('Año;Mes;Uen;Regional;Canal Comercial;Marquilla;Código Producto;Producto;Numérica Clientes;'
+              'Numérica Documentos;Ventas Galones;Ventas;Utilidad Bruta;Costos;Margen')
+
+# Export bronze pequeño con una línea incompleta y un encabezado repetido (como al unir dos exports), que la
+# limpieza debe descartar sin fallar
+filas_bronze = [
+    encabezado,
+    '2022;1;INDUSTRIAL;REGIONAL CALI;Industrial;MARCA1;10000001;PRODUCTO 10000001 GL;3;4;1,5;1000;200,5;799,5;0,2005',
+    '2022;1;DECORATIVO;REGIONAL CALI;Ferreterias;MARCA2;10000002;PRODUCTO 10000002 GL;1;1;2,25;500;100;400;0,2',
+    '2022;1;INDUSTRIAL;REGIONAL BOGOTA;Industrial;MARCA1;10000001;PRODUCTO 10000001 GL;2;2;0,5;300;30;270;0,1',
+    'bad;line;with;too;few',
+    encabezado,
+    '2022;2;DECORATIVO;REGIONAL BOGOTA;Ferreterias;MARCA2;10000002;PRODUCTO 10000002 GL;5;6;3;700;-10;710;-0,01',
+    '2022;2;DECORATIVO;REGIONAL CALI;Ferreterias;MARCA2;10000002;PRODUCTO 10000002 GL;5;6;3;800;80;720;0,1',
+    '2022;2;INDUSTRIAL;REGIONAL CALI;Industrial;MARCA3;10000003;PRODUCTO 10000003 GL;1;1;1;100;10;90;0,1',
+    '2022;2;INDUSTRIAL;REGIONAL CALI;Industrial;MARCA1;10000004;PRODUCTO KIT 10000004 GL;1;1;1;100;10;90;0,1',
+]
+
+
+def crear_bronze(carpeta, filas=filas_bronze, nombre='bronze.csv'):
+    ruta = carpeta / nombre
+    ruta.write_text('\n'.join(filas) + '\n', encoding='utf-8')
+    return ruta
+
+
+def test_incremental_igual_a_completo_con_filas_invalidas(tmp_path):
+    bronze = crear_bronze(tmp_path)
+    procesar_completo(bronze, tmp_path / 'completo.csv')
+    procesar_incremental(bronze, tmp_path / 'incremental.csv')
+
+    assert (tmp_path / 'incremental.csv').read_bytes() == (tmp_path / 'completo.csv').read_bytes()
+    limpio = pd.read_csv(tmp_path / 'completo.csv', dtype={'Código Producto': str})
+    assert len(limpio) == 4
+    assert set(limpio['Código Producto']) == {'10000001', '10000002'}
+
+
+# Con bloques de varios tamaños hay bloques sin filas inválidas, donde 'Año', 'Mes' y las columnas Numérica se
+# leerían como números aunque en el archivo completo son texto
+@pytest.mark.parametrize("tamano_bloque", [1, 2, 3, 4, 100])
+def test_por_bloques_igual_a_completo_con_filas_invalidas(tmp_path, tamano_bloque):
+    bronze = crear_bronze(tmp_path)
+    procesar_completo(bronze, tmp_path / 'completo.csv')
+    procesar_por_bloques(bronze, tmp_path / 'bloques.csv', tamano_bloque)
+
+    assert (tmp_path / 'bloques.csv').read_bytes() == (tmp_path / 'completo.csv').read_bytes()
+
+
+def test_incremental_sin_cambios_conserva_la_salida(tmp_path):
+    bronze = crear_bronze(tmp_path)
+    procesar_incremental(bronze, tmp_path / 'incremental.csv')
+    contenido = (tmp_path / 'incremental.csv').read_bytes()
+
+    procesar_incremental(bronze, tmp_path / 'incremental.csv')
+    assert (tmp_path / 'incremental.csv').read_bytes() == contenido
+
+
+def test_paralelo_igual_a_completo_con_filas_invalidas(tmp_path):
+    bronze = crear_bronze(tmp_path)
+    procesar_completo(bronze, tmp_path / 'completo.csv')
+    procesar_paralelo([bronze], tmp_path / 'paralelo.csv', procesos=2)
+
+    assert (tmp_path / 'paralelo.csv').read_bytes() == (tmp_path / 'completo.csv').read_bytes()
+
+
+def test_paralelo_usa_el_export_mas_reciente_en_periodos_repetidos(tmp_path):
+    antiguo = crear_bronze(tmp_path, nombre='antiguo.csv')
+    # El export reciente repite 2022-2 con otras ventas y agrega 2022-3
+    reciente = crear_bronze(tmp_path, [
+        encabezado,
+        '2022;2;DECORATIVO;REGIONAL CALI;Ferreterias;MARCA2;10000002;PRODUCTO 10000002 GL;5;6;3;900;90;810;0,1',
+        '2022;3;INDUSTRIAL;REGIONAL CALI;Industrial;MARCA1;10000001;PRODUCTO 10000001 GL;1;1;1;400;40;360;0,1',
+    ], nombre='reciente.csv')
+    procesar_paralelo([antiguo, reciente], tmp_path / 'paralelo.csv', procesos=2)
+
+    limpio = pd.read_csv(tmp_path / 'paralelo.csv', dtype={'Código Producto': str})
+    assert list(zip(limpio['Año'], limpio['Mes'], limpio['Ventas'])) == [
+        (2022, 1, 1000), (2022, 1, 500), (2022, 1, 300), (2022, 2, 900), (2022, 3, 400)]
+
+
+# Un export sin 'Regional' no se puede unir con los meses ya limpiados con 'Regional': falla sin modificar nada
+def test_incremental_falla_con_columnas_distintas(tmp_path):
+    procesar_incremental(crear_bronze(tmp_path), tmp_path / 'incremental.csv')
+    contenido = (tmp_path / 'incremental.csv').read_bytes()
+
+    sin_regional = crear_bronze(tmp_path, [
+        encabezado.replace('Regional;', ''),
+        '2022;3;INDUSTRIAL;Industrial;MARCA1;10000001;PRODUCTO 10000001 GL;1;1;1;400;40;360;0,1',
+    ], nombre='sin_regional.csv')
+    with pytest.raises(SystemExit, match=r"faltan \['Regional'\]"):
+        procesar_incremental(sin_regional, tmp_path / 'incremental.csv')
+
+    assert (tmp_path / 'incremental.csv').read_bytes() == contenido
+    assert not (tmp_path / 'incremental_particiones' / '2022-03.csv').exists()
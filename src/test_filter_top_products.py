@@ -0,0 +1,45 @@
+import filter_top_products
+from data_process import procesar_incremental as procesar_silver_incremental
+from test_data_process import crear_bronze, encabezado
+
+# Export bronze con varios productos, regionales y canales en tres meses; los productos 10000001 a 10000003 suman
+# el 80% de las ventas
+filas_bronze = [
+    encabezado,
+    '2022;1;INDUSTRIAL;REGIONAL CALI;Industrial;MARCA1;10000001;PRODUCTO 10000001 GL;3;4;1,5;5000;500;4500;0,1',
+    '2022;1;DECORATIVO;REGIONAL BOGOTA;Ferreterias;MARCA2;10000002;PRODUCTO 10000002 GL;1;1;2,25;3000;300;2700;0,1',
+    '2022;1;DECORATIVO;REGIONAL CALI;Ferreterias;MARCA3;10000004;PRODUCTO 10000004 GL;1;1;1;200;20;180;0,1',
+    '2022;2;INDUSTRIAL;REGIONAL BOGOTA;Industrial;MARCA1;10000001;PRODUCTO 10000001 GL;2;2;0,5;4000;400;3600;0,1',
+    '2022;2;DECORATIVO;REGIONAL CALI;Ferreterias;MARCA2;10000002;PRODUCTO 10000002 GL;5;6;3;2500;250;2250;0,1',
+    '2022;2;INDUSTRIAL;REGIONAL CALI;Industrial;MARCA2;10000003;PRODUCTO 10000003 GL;1;1;1;1500;150;1350;0,1',
+    '2022;2;DECORATIVO;REGIONAL BOGOTA;Ferreterias;MARCA3;10000004;PRODUCTO 10000004 GL;1;1;1;300;30;270;0,1',
+    '2022;3;INDUSTRIAL;REGIONAL CALI;Industrial;MARCA1;10000001;PRODUCTO 10000001 GL;1;1;1;4500;450;4050;0,1',
+    '2022;3;INDUSTRIAL;REGIONAL BOGOTA;Industrial;MARCA2;10000003;PRODUCTO 10000003 GL;1;1;1;1200;120;1080;0,1',
+    '2022;3;DECORATIVO;REGIONAL CALI;Ferreterias;MARCA3;10000005;PRODUCTO 10000005 GL;1;1;1;100;10;90;0,1',
+    '2022;3;DECORATIVO;REGIONAL CALI;Ferreterias;MARCA3;10000005;PRODUCTO 10000005 GL;1;1;1;150;15;135;0,1',
+]
+
+
+# Limpia el export en modo incremental y genera gold en modo incremental y completo a partir del mismo silver
+def construir_gold(carpeta, filas):
+    silver = carpeta / 'silver.csv'
+    procesar_silver_incremental(crear_bronze(carpeta, filas), silver)
+    filter_top_products.procesar_incremental(silver, carpeta / 'gold_incremental.csv')
+    filter_top_products.procesar_completo(silver, carpeta / 'gold_completo.csv')
+    return (carpeta / 'gold_incremental.csv').read_bytes(), (carpeta / 'gold_completo.csv').read_bytes()
+
+
+def test_incremental_igual_a_completo(tmp_path):
+    incremental, completo = construir_gold(tmp_path, filas_bronze)
+    assert incremental == completo
+
+
+# Un export nuevo cambia un mes con una regional y un canal nuevos, que agregan columnas del One-Hot Encoding
+def test_incremental_igual_a_completo_tras_cambiar_una_particion(tmp_path):
+    construir_gold(tmp_path, filas_bronze)
+    filas = filas_bronze + [
+        '2022;2;INDUSTRIAL;REGIONAL MEDELLIN;Constructoras;MARCA1;10000001;PRODUCTO 10000001 GL;1;1;1;2000;200;1800;0,1']
+    incremental, completo = construir_gold(tmp_path, filas)
+
+    assert incremental == completo
+    assert b'Regional_REGIONAL MEDELLIN' in incremental.splitlines()[0]
@@ -1,9 +1,11 @@
 # Importa librerías necesarias
+import os
 import mlflow
 import mlflow.sklearn
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import pandas as pd
+from data_process import leer_parquet
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 
@@ -13,9 +15,13 @@ mlflow.set_tracking_uri("http://34.235.166.100:8050")
 # Configura el nombre del experimento
 mlflow.set_experiment("Proyecto_Prediccion_Ventas")
 
-# Carga los datos
+# Carga los datos (el dataset Parquet de filter_top_products.py --formato parquet si existe, si no el CSV)
 file_path = '../data/gold/ExporteCOL2022_2023_2024_top_products_encoded.csv'
-df = pd.read_csv(file_path)
+parquet_path = '../data/gold/ExporteCOL2022_2023_2024_top_products_encoded.parquet'
+if os.path.exists(parquet_path):
+    df = leer_parquet(parquet_path)
+else:
+    df = pd.read_csv(file_path)
 
 # Separa las variables predictoras y la variable objetivo
 X = df.drop(columns=['Ventas', 'Código Producto', 'Producto'])